@@ -0,0 +1,273 @@
+"""
+Headless batch processing of recorded sessions.
+
+Example:
+    python batch_process.py "sessions/*.mov" -o results.csv --workers 8 --max-memory-mb 2048
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+
+from hrv_metrics import batch_hrv_metrics, hrv_metrics_rows, pack_rr_series
+from pipeline import analyze_video, analyze_video_subjects
+from result_cache import ResultCache
+from signal_methods import DEFAULT_METHOD, SIGNAL_METHODS
+
+# Extended HRV columns (--extended-hrv) and the hrv_metrics.METRIC_NAMES entry each is read from
+EXTENDED_HRV_FIELDS = {
+    'rr_count': 'count', 'mean_rr': 'mean_rr', 'mean_hr': 'mean_hr', 'sdsd': 'sdsd', 'pnn50': 'pnn50',
+    'triangular_index': 'triangular_index', 'vlf': 'vlf', 'lf': 'lf', 'hf': 'hf', 'lf_hf': 'lf_hf',
+    'sd1': 'sd1', 'sd2': 'sd2',
+}
+
+RESULT_FIELDS = [
+    'video', 'path', 'subject', 'first_frame', 'frames', 'fps', 'heart_rate', 'sdnn', 'rmssd', 'hrv_valid',
+    *EXTENDED_HRV_FIELDS, 'cached', 'extract_seconds', 'analysis_seconds', 'seconds', 'error',
+]
+
+
+# Expand file names and glob patterns into a sorted, de-duplicated list of videos
+def expand_inputs(patterns):
+    paths = []
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive=True)
+        paths.extend(matches if matches else [pattern])
+    return sorted(set(paths))
+
+
+# Runs once in every worker process
+def _init_worker(max_memory_mb):
+    # Each process already handles one video, so keep OpenCV single-threaded
+    cv2.setNumThreads(1)
+
+    if max_memory_mb:
+        try:
+            import resource
+        except ImportError:
+            return
+        limit = int(max_memory_mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+# Result row recording that a video could not be analysed
+def _error_row(path, error):
+    return {'video': os.path.basename(path), 'path': path, 'error': error}
+
+
+# Analyse one video, turning failures into an error row instead of killing the batch.
+# Returns a list of rows: one per video, or one per face with multi_subject
+def _process_one(path, freq_min, freq_max, use_skin_mask, cache, multi_subject=False,
+                 use_face_regions=False, method=DEFAULT_METHOD, target_size=None, target_fps=None):
+    start = time.perf_counter()
+    try:
+        if multi_subject:
+            # Each worker analyses its subjects serially; the pool already fills the CPUs
+            rows = analyze_video_subjects(path, freq_min, freq_max, use_skin_mask, workers=1, cache=cache,
+                                          method=method, target_size=target_size, target_fps=target_fps)
+            if not rows:
+                rows = [_error_row(path, 'no subjects tracked')]
+        else:
+            rows = [analyze_video(path, freq_min, freq_max, use_skin_mask, cache, use_face_regions, method,
+                                  target_size, target_fps)]
+    except MemoryError:
+        rows = [_error_row(path, 'memory limit exceeded')]
+    except Exception as e:
+        rows = [_error_row(path, str(e))]
+
+    seconds = round(time.perf_counter() - start, 4)
+    for row in rows:
+        row.setdefault('error', '')
+        row['seconds'] = seconds
+    return rows
+
+
+# Rows of a finished future; a crashed worker (e.g. aborted under the memory cap) returns None
+def _future_rows(future, path):
+    try:
+        return future.result()
+    except BrokenProcessPool:
+        return None
+    except Exception as e:
+        return [dict(_error_row(path, str(e)), seconds='')]
+
+
+# Retry a video whose pool broke in a pool of its own, so a crash only costs its own row
+def _process_isolated(path, max_memory_mb, args):
+    with ProcessPoolExecutor(max_workers=1, initializer=_init_worker, initargs=(max_memory_mb,)) as executor:
+        rows = _future_rows(executor.submit(_process_one, path, *args), path)
+    if rows is None:
+        rows = [dict(_error_row(path, 'worker crashed'), seconds='')]
+    return rows
+
+
+# Run _process_one over paths in a process pool, yielding rows in completion order
+def _iter_rows(paths, workers, max_memory_mb, args):
+    workers = workers or os.cpu_count() or 1
+    pending = list(reversed(paths))
+
+    while pending:
+        crashed = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(max_memory_mb,)) as executor:
+            in_flight = {}
+            while (pending and not crashed) or in_flight:
+                while pending and not crashed and len(in_flight) < workers:
+                    path = pending.pop()
+                    in_flight[executor.submit(_process_one, path, *args)] = path
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = in_flight.pop(future)
+                    rows = _future_rows(future, path)
+                    if rows is None:
+                        crashed.append(path)
+                    else:
+                        yield from rows
+
+        for path in crashed:
+            yield from _process_isolated(path, max_memory_mb, args)
+
+
+# Score the RR intervals of all rows with one batch_hrv_metrics call and add the extended columns
+def _add_extended_hrv(rows):
+    values, offsets = pack_rr_series(row.pop('rr_intervals', []) for row in rows)
+    for row, metrics in zip(rows, hrv_metrics_rows(batch_hrv_metrics(values, offsets))):
+        if row['error']:
+            continue
+        for field, name in EXTENDED_HRV_FIELDS.items():
+            value = metrics[name]
+            # Undefined metrics (too few beats) are NaN, written as empty cells / null
+            row[field] = None if isinstance(value, float) and np.isnan(value) else value
+    return rows
+
+
+def process_videos(paths, freq_min=1.0, freq_max=1.8, workers=None,
+                   max_memory_mb=None, use_skin_mask=False, cache=None, multi_subject=False,
+                   use_face_regions=False, method=DEFAULT_METHOD, target_size=None, target_fps=None,
+                   extended_hrv=False):
+    """
+    Analyse many videos in parallel with a process pool.
+
+    Args:
+        paths: Video file paths
+        freq_min: Minimum heart rate frequency in Hz
+        freq_max: Maximum heart rate frequency in Hz
+        workers: Number of worker processes, defaults to os.cpu_count()
+        max_memory_mb: Address space cap per worker, None for no cap
+        use_skin_mask: Average only skin-coloured ROI pixels
+        cache: Optional result_cache.ResultCache shared by all workers
+        multi_subject: Track every face and emit one row per subject
+        use_face_regions: Average SNR-weighted forehead and cheek patches instead of the face box
+        method: Pulse signal method, a name in signal_methods.SIGNAL_METHODS
+        target_size: (width, height) box frames are downscaled to fit when decoding
+        target_fps: Decimate to about this frame rate when decoding
+        extended_hrv: Add the EXTENDED_HRV_FIELDS columns, scored for all videos
+            at once with hrv_metrics.batch_hrv_metrics; rows are then only
+            yielded once the whole batch has finished
+
+    A worker that dies (a segfault, or an abort under the memory cap) breaks
+    its whole pool. Only `workers` videos are submitted at a time, so the
+    videos in flight are then retried one by one in pools of their own,
+    the one that crashes again gets an error row, and the rest of the batch
+    continues in a fresh pool.
+
+    Yields:
+        dict: One result row per video (or per subject), in completion order
+    """
+    args = (freq_min, freq_max, use_skin_mask, cache, multi_subject, use_face_regions, method,
+            target_size, target_fps)
+    rows = _iter_rows(paths, workers, max_memory_mb, args)
+    if extended_hrv:
+        yield from _add_extended_hrv(list(rows))
+        return
+
+    for row in rows:
+        row.pop('rr_intervals', None)
+        yield row
+
+
+# Parse a WIDTHxHEIGHT size argument
+def _parse_size(value):
+    try:
+        width, height = (int(v) for v in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {value!r}")
+    return width, height
+
+
+# Write rows as CSV or JSON lines, depending on the output extension or --format
+def _open_writer(stream, fmt):
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=RESULT_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        return writer.writerow
+    return lambda row: stream.write(json.dumps(row) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless heart rate / HRV batch processing")
+    parser.add_argument('inputs', nargs='+', help="Video files or glob patterns")
+    parser.add_argument('-o', '--output', help="Output file (.csv or .jsonl), stdout if omitted")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help="Output format, inferred from --output")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--max-memory-mb', type=int, default=None, help="Memory cap per worker in MB")
+    parser.add_argument('--freq-min', type=float, default=1.0, help="Minimum heart rate frequency in Hz")
+    parser.add_argument('--freq-max', type=float, default=1.8, help="Maximum heart rate frequency in Hz")
+    parser.add_argument('--skin-mask', action='store_true', help="Average only skin-coloured ROI pixels")
+    parser.add_argument('--analysis-size', type=_parse_size, default=None, metavar='WxH',
+                        help="Downscale decoded frames to fit this size, e.g. 640x480")
+    parser.add_argument('--target-fps', type=float, default=None,
+                        help="Decimate decoded frames to about this frame rate")
+    parser.add_argument('--method', choices=sorted(SIGNAL_METHODS), default=DEFAULT_METHOD,
+                        help="Pulse signal method applied to the ROI mean trace")
+    parser.add_argument('--face-regions', action='store_true',
+                        help="Average forehead and cheek patches, weighted by pulse SNR")
+    parser.add_argument('--extended-hrv', action='store_true',
+                        help="Add time, frequency and Poincare HRV columns, scored once the batch finishes")
+    parser.add_argument('--multi-subject', action='store_true',
+                        help="Track every face and write one row per subject")
+    parser.add_argument('--cache-dir', help="Reuse traces/spectra/results cached in this directory")
+    parser.add_argument('--cache-max-mb', type=int, default=1024, help="Cache size limit in MB")
+    args = parser.parse_args(argv)
+
+    cache = None
+    if args.cache_dir:
+        cache = ResultCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        parser.error("no input videos found")
+
+    fmt = args.format
+    if fmt is None:
+        fmt = 'csv' if args.output and args.output.endswith('.csv') else 'jsonl'
+
+    stream = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        write_row = _open_writer(stream, fmt)
+        failed = 0
+        for row in process_videos(paths, args.freq_min, args.freq_max, args.workers,
+                                  args.max_memory_mb, args.skin_mask, cache, args.multi_subject,
+                                  args.face_regions, args.method, args.analysis_size, args.target_fps,
+                                  args.extended_hrv):
+            write_row(row)
+            stream.flush()
+            failed += bool(row['error'])
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+"""
+Offline benchmark of every pipeline stage on a synthetic pulsatile video.
+
+A skin-coloured patch whose colour is modulated at a known pulse frequency
+is written to a temporary lossless video, then each stage is timed on it.
+Results are printed (or written) as JSON so runs can be compared across
+commits.
+
+Example:
+    python benchmark.py --duration 6 --width 640 --height 480 -o bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import eulerian
+import heartrate
+import preprocessing
+import pyramids
+from signal_extraction import extract_channel_means
+
+
+class FixedROITracker:
+    """Stand-in for preprocessing.ROITracker that always returns the synthetic face patch."""
+
+    def __init__(self, rect):
+        self.rect = rect
+        self.timings = {'detect': 0.0, 'detect_calls': 0, 'track': 0.0, 'track_calls': 0}
+
+    def update(self, img):
+        return self.rect
+
+
+def make_synthetic_video(path, width=320, height=240, duration=6.0, fps=30, pulse_hz=1.25,
+                         amplitude=2.0, noise=1.0, seed=0):
+    """
+    Write a video with a skin-coloured patch pulsing at pulse_hz.
+
+    Returns:
+        Tuple containing:
+        - path: Path of the written video
+        - rect: (x, y, w, h) of the pulsing patch
+    """
+    rng = np.random.default_rng(seed)
+    frame_ct = int(round(duration * fps))
+
+    fourcc = cv2.VideoWriter_fourcc(*'FFV1')
+    writer = cv2.VideoWriter(path, fourcc, fps, (width, height))
+    if not writer.isOpened():
+        # Fall back to a codec every OpenCV build ships
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+
+    rect = (width // 4, height // 4, width // 2, height // 2)
+    (x, y, w, h) = rect
+    background = rng.integers(40, 80, size=(height, width, 3), dtype=np.uint8)
+    skin = np.array([120, 150, 200], dtype=np.float32)  # BGR
+    pulse_weights = np.array([0.2, 1.0, 0.5], dtype=np.float32)
+
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    for i in range(frame_ct):
+        t = i / fps
+        colour = skin + amplitude * np.sin(2 * np.pi * pulse_hz * t) * pulse_weights
+        frame[:] = background
+        patch = colour + rng.normal(0, noise, size=(h, w, 3))
+        frame[y:y + h, x:x + w] = np.clip(patch, 0, 255)
+        writer.write(frame)
+
+    writer.release()
+    return path, rect
+
+
+# Time a stage, recording wall/CPU time and the peak of Python/NumPy allocations
+def _run_stage(results, name, frame_ct, func, *args):
+    tracemalloc.start()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+
+    value = func(*args)
+
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    results.append({
+        'stage': name,
+        'seconds': round(wall, 5),
+        'cpu_seconds': round(cpu, 5),
+        'frames': frame_ct,
+        'frames_per_second': round(frame_ct / wall, 2) if wall > 0 else None,
+        'peak_alloc_mb': round(peak / 2 ** 20, 2),
+        'peak_rss_mb': round(_peak_rss_mb(), 2),
+    })
+    return value
+
+
+# Peak resident set size of this process so far
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Eulerian magnification of a (T, H, W, 3) video in the given working dtype, as in main.py
+def _magnify(video, fps, freq_min, freq_max, dtype, amplification=50.0):
+    lap_video = pyramids.build_laplacian_video_pyramid(video, dtype=dtype)
+    for level in lap_video[1:-1]:
+        eulerian.magnify_level(level, freq_min, freq_max, fps, amplification)
+    return lap_video, pyramids.collapse_laplacian_video_pyramid_parallel(lap_video)
+
+
+def check_precision(video, fps, freq_min=1.0, freq_max=1.8, dtype=np.float32):
+    """
+    Compare the magnification pipeline in a reduced working dtype against float64.
+
+    Returns:
+        dict: Largest relative error of any pyramid level after magnification,
+        and the largest and mean absolute difference of the uint8 output in grey levels
+    """
+    reference_levels, reference = _magnify(video.astype(np.float64), fps, freq_min, freq_max, np.float64)
+    levels, output = _magnify(video, fps, freq_min, freq_max, dtype)
+
+    level_error = max(float(np.abs(level - ref).max() / max(np.abs(ref).max(), np.finfo(np.float64).tiny))
+                      for level, ref in zip(levels, reference_levels))
+    difference = np.abs(output.astype(np.int16) - reference.astype(np.int16))
+    return {
+        'dtype': np.dtype(dtype).name,
+        'max_level_rel_error': level_error,
+        'max_output_error': int(difference.max()),
+        'mean_output_error': round(float(difference.mean()), 5),
+    }
+
+
+def run_benchmark(width=320, height=240, duration=6.0, fps=30, pulse_hz=1.25,
+                  freq_min=1.0, freq_max=1.8, dtype=np.float32):
+    """
+    Run every pipeline stage on a synthetic video and collect timings.
+
+    Args:
+        dtype: Working dtype of the frames and pyramids, checked against float64
+
+    Returns:
+        dict: Benchmark parameters, per-stage results, heart rate accuracy
+        and the precision check of the working dtype
+    """
+    stages = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path, rect = make_synthetic_video(os.path.join(tmp_dir, 'synthetic.avi'),
+                                          width, height, duration, fps, pulse_hz)
+        frame_ct = int(round(duration * fps))
+
+        video_frames, frame_ct, video_fps = _run_stage(
+            stages, 'read_video', frame_ct, preprocessing.read_video, path, FixedROITracker(rect), dtype)
+
+    lap_video = _run_stage(stages, 'build_video_pyramid', frame_ct,
+                           pyramids.build_video_pyramid, video_frames, None, 3, dtype)
+    video_array = np.asarray(video_frames)
+    _run_stage(stages, 'build_laplacian_video_pyramid', frame_ct,
+               pyramids.build_laplacian_video_pyramid, video_array, 3, dtype)
+    del video_array
+
+    spectrum, frequencies = _run_stage(stages, 'fft_filter', frame_ct,
+                                       eulerian.fft_filter, video_frames, freq_min, freq_max, video_fps)
+    trace = _run_stage(stages, 'extract_channel_means', frame_ct, extract_channel_means, video_frames)
+    trace_spectrum, trace_frequencies = _run_stage(stages, 'fft_filter_trace', frame_ct,
+                                                   eulerian.fft_filter, trace, freq_min, freq_max, video_fps)
+
+    # The untimed trace run also warms up the lazily imported scipy
+    trace_result = heartrate.find_heart_rate(trace_spectrum, trace_frequencies, freq_min, freq_max, frame_ct)
+    result = _run_stage(stages, 'find_heart_rate', frame_ct,
+                        heartrate.find_heart_rate, spectrum, frequencies, freq_min, freq_max, frame_ct)
+
+    _run_stage(stages, 'collapse_laplacian_video_pyramid', frame_ct,
+               pyramids.collapse_laplacian_video_pyramid, lap_video, frame_ct)
+    _run_stage(stages, 'collapse_laplacian_video_pyramid_parallel', frame_ct,
+               pyramids.collapse_laplacian_video_pyramid_parallel, lap_video)
+    del lap_video
+
+    # Runs the magnification twice, once in float64; kept after the timed stages so its
+    # memory peak does not show up in their peak_rss_mb (ru_maxrss never decreases)
+    precision = check_precision(np.asarray(video_frames), video_fps, freq_min, freq_max, dtype)
+
+    true_bpm = pulse_hz * 60
+    return {
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'cpu_count': os.cpu_count(),
+        'params': {
+            'width': width, 'height': height, 'duration': duration, 'fps': fps,
+            'pulse_hz': pulse_hz, 'freq_min': freq_min, 'freq_max': freq_max,
+            'dtype': np.dtype(dtype).name,
+        },
+        'stages': stages,
+        'accuracy': {
+            'true_bpm': true_bpm,
+            'frames_bpm': float(result['heart_rate']),
+            'frames_error_bpm': round(abs(float(result['heart_rate']) - true_bpm), 2),
+            'trace_bpm': float(trace_result['heart_rate']),
+            'trace_error_bpm': round(abs(float(trace_result['heart_rate']) - true_bpm), 2),
+        },
+        'precision': precision,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark pipeline stages on a synthetic pulsatile video")
+    parser.add_argument('--width', type=int, default=320)
+    parser.add_argument('--height', type=int, default=240)
+    parser.add_argument('--duration', type=float, default=6.0, help="Clip length in seconds")
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--pulse-hz', type=float, default=1.25, help="Injected pulse frequency")
+    parser.add_argument('--dtype', choices=['float32', 'float64'], default='float32',
+                        help="Working dtype of frames and pyramids")
+    parser.add_argument('-o', '--output', help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.width, args.height, args.duration, args.fps, args.pulse_hz,
+                           dtype=np.dtype(args.dtype))
+    text = json.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""
+Threaded camera capture and file loading, decoupled from the UI.
+
+A CaptureThread reads the camera as fast as it delivers frames and stamps
+each one with a monotonic clock on arrival. Frames go two ways:
+
+    - into a bounded queue for a FrameWorker, which runs the analysis
+      (frame store, live heart rate) on its own thread; when the queue is
+      full the oldest frame is dropped and counted, so capture never blocks,
+    - into a "latest frame" slot the UI polls at its own, capped rate.
+
+Neither the UI nor the analysis can stall the capture loop, so the
+sampling stays regular, and any frame that does get dropped leaves a gap in
+the timestamps instead of silently shifting the signal.
+
+A FileLoader does the same for uploads: it decodes a VideoSource into a
+FrameStore on its own thread, while the UI polls its progress at a fixed
+interval and the analysis may already consume the frames loaded so far.
+"""
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from frame_store import FrameStore
+
+# Frames buffered between the capture thread and the worker, about 2 s at 30 fps
+DEFAULT_QUEUE_SIZE = 64
+
+# Initial store size of an upload whose container reports no frame count
+UNKNOWN_LENGTH_SECONDS = 60
+
+
+class CaptureThread(threading.Thread):
+    """
+    Reads a cv2.VideoCapture on a background thread.
+    """
+
+    def __init__(self, device=0, queue_size=DEFAULT_QUEUE_SIZE):
+        """
+        Args:
+            device: Camera index or video path passed to cv2.VideoCapture
+            queue_size: Capacity of the frames queue, 0 for no queue (preview only)
+        """
+        super().__init__(daemon=True)
+        self.cap = cv2.VideoCapture(device)
+        if not self.cap.isOpened():
+            raise IOError("Could not open video capture device")
+
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        (width, height) = (int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                           int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        if not (width and height):
+            # Some backends only know the frame size once a frame has been read
+            ret, frame = self.cap.read()
+            if not ret:
+                raise IOError("Could not read from video capture device")
+            (height, width) = frame.shape[:2]
+        self.frame_shape = (height, width, 3)
+        self.frames = queue.Queue(maxsize=queue_size) if queue_size else None
+        self.frame_count = 0
+        self.dropped = 0
+        self.start_time = None
+        self._latest = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        self.start_time = time.monotonic()
+        try:
+            while not self._stop_event.is_set():
+                ret, frame = self.cap.read()
+                timestamp = time.monotonic() - self.start_time
+                if not ret:
+                    break
+
+                with self._lock:
+                    self._latest = (frame, timestamp, self.frame_count)
+                self.frame_count += 1
+                if self.frames is not None:
+                    self._push((frame, timestamp))
+        finally:
+            self.cap.release()
+            # End of stream marker for the worker
+            if self.frames is not None:
+                self._push(None)
+
+    def _push(self, item):
+        # Never block the capture loop: make room by dropping the oldest frame
+        while True:
+            try:
+                self.frames.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def latest(self):
+        """
+        Return the most recent (frame, timestamp, index), or None before the first frame.
+        """
+        with self._lock:
+            return self._latest
+
+    @property
+    def measured_fps(self):
+        """Frames actually delivered per second since capture started."""
+        if self.start_time is None or self.frame_count < 2:
+            return None
+        return self.frame_count / (time.monotonic() - self.start_time)
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+
+class FrameWorker(threading.Thread):
+    """
+    Calls handler(frame, timestamp) for every frame of a CaptureThread's queue.
+
+    The handler runs on this thread, so it must not touch Tk widgets; it can
+    return True to stop consuming early. Exceptions end the worker and are
+    kept in `error`.
+    """
+
+    def __init__(self, frames, handler):
+        super().__init__(daemon=True)
+        self.frames = frames
+        self.handler = handler
+        self.processed = 0
+        self.error = None
+        self.done = threading.Event()
+
+    def run(self):
+        try:
+            while True:
+                item = self.frames.get()
+                if item is None:
+                    break
+                if self.handler(*item):
+                    break
+                self.processed += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+
+class FileLoader(threading.Thread):
+    """
+    Decodes a VideoSource into a FrameStore on a background thread.
+
+    Progress is exposed as plain attributes (loaded, total) for the UI to
+    poll, and iter_frames() lets a consumer process frames while the rest
+    of the file is still loading.
+
+    The loader owns its store until the caller takes it over once done is
+    set. A container's frame count is only an estimate (or unknown), so the
+    store is sized with headroom and doubled whenever it fills up.
+    """
+
+    def __init__(self, source, path):
+        """
+        Args:
+            source: ingest.VideoSource to decode
+            path: File the FrameStore is created at, grown stores get a suffix
+        """
+        super().__init__(daemon=True)
+        self.source = source
+        self.path = path
+        self.store = None
+        self.total = source.frame_count
+        self.loaded = 0
+        self.timestamps = []
+        self.error = None
+        self.done = threading.Event()
+        self._cancelled = threading.Event()
+        self._available = threading.Condition()
+
+    def run(self):
+        try:
+            for frame, timestamp in self.source:
+                if self._cancelled.is_set():
+                    break
+                if self.store is None:
+                    self.store = FrameStore.create(self.path, self._initial_capacity(), frame.shape,
+                                                   self.source.fps)
+                slot = self.store.next_slot()
+                if slot is None:
+                    self._grow()
+                    slot = self.store.next_slot()
+
+                np.copyto(slot, frame)
+                self.store.commit(timestamp)
+                self.timestamps.append(timestamp)
+                with self._available:
+                    self.loaded += 1
+                    self._available.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.source.release()
+            if self.store is not None:
+                self.store.flush()
+            with self._available:
+                self.done.set()
+                self._available.notify_all()
+
+    def _initial_capacity(self):
+        if self.total:
+            return int(self.total * 1.1) + 1
+        return max(int(self.source.fps * UNKNOWN_LENGTH_SECONDS), 1)
+
+    def _grow(self):
+        old = self.store
+        store = old.resized(f"{self.path}.{old.capacity * 2}", old.capacity * 2)
+        # Swapped under the lock so iter_frames never reads from a closed store;
+        # frames it already handed out stay valid, the mapping lives as long as they do
+        with self._available:
+            self.store = store
+        old.close(delete=True)
+
+    def discard(self):
+        """Delete the store of a cancelled or failed load."""
+        if self.store is not None:
+            self.store.close(delete=True)
+            self.store = None
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self, timeout=None):
+        if self.done.is_set():
+            return
+        self._cancelled.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def iter_frames(self):
+        """
+        Yield stored frames in order, waiting for the loader as needed.
+
+        Raises:
+            RuntimeError: If loading is cancelled or fails before the last frame
+        """
+        index = 0
+        while True:
+            with self._available:
+                while index >= self.loaded and not self.done.is_set():
+                    self._available.wait()
+                available = self.loaded
+            if index >= available:
+                break
+            while index < available:
+                with self._available:
+                    frame = self.store[index]
+                yield frame
+                index += 1
+
+        if self.cancelled:
+            raise RuntimeError("Loading was cancelled")
+        if self.error is not None:
+            raise RuntimeError(f"Loading failed: {self.error}")
@@ -0,0 +1 @@
+# Lets the tests under tests/ import the flat modules at the repository root
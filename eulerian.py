@@ -1,32 +1,296 @@
+from functools import lru_cache
+
 import numpy as np
-from frame_processor import process_frames_in_batches, compute_batch_fft, aggregate_batch_results
+
+import profiling
+import pyramids
+from signal_extraction import extract_channel_means, to_luminance
+
+
+# Reduce frames (or a channel mean trace) to a single per-frame mean signal
+def _mean_signal(video_frames):
+    if isinstance(video_frames, np.ndarray) and video_frames.ndim == 1:
+        return video_frames
+    if not (isinstance(video_frames, np.ndarray) and video_frames.ndim == 2):
+        video_frames = extract_channel_means(video_frames)
+    return to_luminance(video_frames)
+
+
+# Frequencies and pass-band mask of a real FFT, cached per length and band
+@lru_cache(maxsize=32)
+def _band_mask(nfft, fps, freq_min, freq_max):
+    frequencies = np.fft.rfftfreq(nfft, d=1.0 / fps)
+    mask = (frequencies >= freq_min) & (frequencies <= freq_max)
+    frequencies.flags.writeable = False
+    mask.flags.writeable = False
+    return frequencies, mask
+
+
+# Zero-padded rfft of a mean signal with everything outside the band zeroed
+def _filtered_spectrum(signal, freq_min, freq_max, fps):
+    from scipy.fft import next_fast_len
+
+    # Always even, so the spectrum ends exactly at Nyquist (see heartrate.find_heart_rate)
+    nfft = 2 * next_fast_len(max((len(signal) + 1) // 2, 1), real=True)
+
+    spectrum = np.fft.rfft(signal - signal.mean() if len(signal) else signal, n=nfft)
+    frequencies, mask = _band_mask(nfft, float(fps), float(freq_min), float(freq_max))
+    spectrum[~mask] = 0
+
+    return spectrum, frequencies, nfft
 
 
 # Temporal bandpass filter with Fast-Fourier Transform
 def fft_filter(video_frames, freq_min, freq_max, fps):
     """
-    Apply temporal bandpass filter using FFT with memory-efficient batch processing.
-    
+    Apply temporal bandpass filter using a single real FFT over the whole signal.
+
+    Frames are reduced to their per-frame grayscale mean one at a time
+    (channel means with cv2.mean, then the BGR2GRAY weights), then the whole
+    signal is zero-padded to a fast FFT length and transformed once, so the
+    spectrum has the full resolution of the clip (fps / nfft).
+
     Args:
-        video_frames: List of video frames
+        video_frames: List or iterator of video frames, consumed incrementally,
+            or a (T, 3) channel mean trace from signal_extraction
+            (or a (T,) grayscale trace)
         freq_min: Minimum frequency to keep
         freq_max: Maximum frequency to keep
         fps: Frames per second
-    
+
     Returns:
         Tuple containing:
-        - filtered_signal: The processed signal after FFT filtering
+        - filtered_signal: The band-passed rfft spectrum
         - frequencies: The frequency array
     """
-    batch_results = []
-    
-    # Process frames in batches
-    for frame_batch in process_frames_in_batches(video_frames, batch_size=100):
-        # Compute FFT for current batch
-        fft, freqs = compute_batch_fft(frame_batch, fps, freq_min, freq_max)
-        batch_results.append((fft, freqs))
-    
-    # Combine results from all batches
-    filtered_signal, frequencies = aggregate_batch_results(batch_results, fps)
-    
-    return filtered_signal, frequencies
\ No newline at end of file
+    with profiling.stage('fft') as record:
+        signal = _mean_signal(video_frames)
+        spectrum, frequencies, nfft = _filtered_spectrum(signal, freq_min, freq_max, fps)
+        if record is not None:
+            record['frames'] = len(signal)
+
+    return spectrum, frequencies
+
+
+# Temporal filters of the Eulerian magnification: the ideal FFT band-pass over
+# the whole clip, or one of the causal per-frame filters of TemporalBandpass
+TEMPORAL_FILTERS = ('fft', 'butter', 'difference')
+
+
+class TemporalBandpass:
+    """
+    Causal per-pixel temporal band-pass, fed one frame at a time.
+
+    Only the filter state of every pixel is kept, O(h * w) memory whatever
+    the length of the video, so pyramid levels can be magnified as frames
+    stream in instead of FFT-ing each pixel's whole history.
+
+        butter      Butterworth band-pass as second-order sections,
+                    direct form II transposed
+        difference  difference of two first-order lowpasses with cutoffs
+                    freq_max and freq_min, as in the original EVM code;
+                    cheaper, but its pass-band is broad and its peak gain
+                    well below 1 for a narrow band, so it needs a larger
+                    amplification
+
+    Both start in steady state on the first frame, so there is no
+    transient from an implicit zero history.
+    """
+
+    def __init__(self, shape, freq_min, freq_max, fps, mode='butter', order=1, dtype=np.float32):
+        """
+        Args:
+            shape: Shape of one frame (or pyramid level frame)
+            freq_min: Lower cutoff in Hz
+            freq_max: Upper cutoff in Hz
+            fps: Frames per second
+            mode: 'butter' or 'difference'
+            order: Butterworth order, giving `order` second-order sections
+            dtype: Working dtype of the state and output
+        """
+        if mode == 'butter':
+            from scipy.signal import butter, sosfilt_zi
+            sos = butter(order, [freq_min, freq_max], btype='bandpass', fs=fps, output='sos')
+            self.sos = sos.astype(dtype)
+            self._zi = sosfilt_zi(sos).astype(dtype)
+            self.state = np.empty((len(sos), 2) + tuple(shape), dtype=dtype)
+        elif mode == 'difference':
+            # First-order lowpass y += r (x - y), with r set by the cutoff frequency
+            self.rates = [np.dtype(dtype).type(1 - np.exp(-2 * np.pi * f / fps)) for f in (freq_max, freq_min)]
+            self.state = np.empty((2,) + tuple(shape), dtype=dtype)
+        else:
+            raise ValueError(f"Unknown temporal filter: {mode!r}, expected 'butter' or 'difference'")
+
+        self.mode = mode
+        self.started = False
+        self._buffers = [np.empty(shape, dtype=dtype) for _ in range(3)]
+
+    def __call__(self, frame, out=None):
+        """
+        Filter the next frame.
+
+        Args:
+            frame: Frame of the shape given at construction
+            out: Optional output array, a new one is allocated if None
+
+        Returns:
+            The band-passed frame
+        """
+        if out is None:
+            out = np.empty_like(self._buffers[0])
+
+        if not self.started:
+            self.started = True
+            if self.mode == 'butter':
+                # Steady state for a constant input equal to the first frame
+                for section, zi in zip(self.state, self._zi):
+                    np.multiply(zi[0], frame, out=section[0])
+                    np.multiply(zi[1], frame, out=section[1])
+            else:
+                self.state[:] = frame
+
+        if self.mode == 'butter':
+            self._sos_step(frame, out)
+        else:
+            self._difference_step(frame, out)
+        return out
+
+    def _sos_step(self, frame, out):
+        (a, b, tmp) = self._buffers
+        x = frame
+        for (b0, b1, b2, _, a1, a2), (z0, z1) in zip(self.sos, self.state):
+            y = a if x is not a else b
+            # y = b0 x + z0;  z0 = b1 x - a1 y + z1;  z1 = b2 x - a2 y
+            np.multiply(x, b0, out=y)
+            y += z0
+            np.multiply(x, b1, out=z0)
+            z0 += z1
+            np.multiply(y, a1, out=tmp)
+            z0 -= tmp
+            np.multiply(x, b2, out=z1)
+            np.multiply(y, a2, out=tmp)
+            z1 -= tmp
+            x = y
+        np.copyto(out, x, casting="unsafe")
+
+    def _difference_step(self, frame, out):
+        tmp = self._buffers[2]
+        for rate, lowpass in zip(self.rates, self.state):
+            np.subtract(frame, lowpass, out=tmp)
+            tmp *= rate
+            lowpass += tmp
+        np.subtract(self.state[0], self.state[1], out=out, casting="unsafe")
+
+
+def magnify_level(level, freq_min, freq_max, fps, amplification=50.0, chunk_bytes=1 << 27, mode='fft'):
+    """
+    Eulerian magnification of one pyramid level: band-pass every pixel in
+    time and add the amplified result back, in place.
+
+    Only needed to render an amplified video; heart rate comes from the
+    mean trace (see signal_methods). With the 'fft' filter, pixels are
+    processed in blocks of rows so the complex spectrum stays under
+    chunk_bytes; the FFTs run in the level's precision, complex64 for a
+    float32 level. The causal filters of TemporalBandpass walk the level
+    frame by frame instead.
+
+    Args:
+        level: (T, h, w, C) float pyramid level, modified in place
+        freq_min: Minimum frequency to amplify
+        freq_max: Maximum frequency to amplify
+        fps: Frames per second
+        amplification: Gain applied to the band-passed variations
+        chunk_bytes: Approximate memory budget of one block's spectrum
+        mode: Temporal filter, one of TEMPORAL_FILTERS
+
+    Returns:
+        The magnified level
+    """
+    from scipy.fft import next_fast_len
+
+    if mode not in TEMPORAL_FILTERS:
+        raise ValueError(f"Unknown temporal filter: {mode!r}, expected one of {TEMPORAL_FILTERS}")
+
+    frame_ct = level.shape[0]
+    if frame_ct < 2:
+        return level
+
+    if mode != 'fft':
+        bandpass = TemporalBandpass(level.shape[1:], freq_min, freq_max, fps, mode, dtype=level.dtype)
+        filtered = np.empty(level.shape[1:], dtype=level.dtype)
+        with profiling.stage('magnify', frame_ct):
+            for frame in level:
+                bandpass(frame, out=filtered)
+                filtered *= amplification
+                frame += filtered
+        return level
+
+    nfft = 2 * next_fast_len((frame_ct + 1) // 2, real=True)
+    frequencies, mask = _band_mask(nfft, float(fps), float(freq_min), float(freq_max))
+    itemsize = np.result_type(level.dtype, np.complex64).itemsize
+    row_bytes = (nfft // 2 + 1) * int(np.prod(level.shape[2:])) * itemsize
+    rows = max(1, chunk_bytes // row_bytes)
+
+    with profiling.stage('magnify', frame_ct):
+        for y in range(0, level.shape[1], rows):
+            block = level[:, y:y + rows]
+            spectrum = np.fft.rfft(block, n=nfft, axis=0)
+            spectrum[~mask] = 0
+            filtered = np.fft.irfft(spectrum, n=nfft, axis=0)[:frame_ct]
+            block += (amplification * filtered).astype(level.dtype, copy=False)
+
+    return level
+
+
+def iter_magnified_frames(frames, freq_min, freq_max, fps, amplification=50.0, levels=3,
+                          mode='butter', dtype=np.float32):
+    """
+    Stream Eulerian magnification over frames, one frame in, one frame out.
+
+    Each frame's Laplacian pyramid is built into buffers reused across
+    frames, its middle levels are band-passed by a causal TemporalBandpass
+    and amplified, and the pyramid is collapsed. Memory stays O(H * W)
+    whatever the length of the video, so long videos and live previews can
+    be magnified without holding the clip.
+
+    Args:
+        frames: Iterable of (H, W, 3) frames, e.g. from preprocessing.stream_video
+        freq_min: Minimum frequency to amplify
+        freq_max: Maximum frequency to amplify
+        fps: Frames per second
+        amplification: Gain applied to the band-passed variations
+        levels: Number of pyramid levels
+        mode: 'butter' or 'difference', see TemporalBandpass
+        dtype: Working dtype of the pyramid and filter state
+
+    Returns:
+        Iterator over uint8 (H, W, 3) magnified frames
+    """
+    if mode == 'fft':
+        raise ValueError("The 'fft' filter needs whole levels; use magnify_level on a video pyramid")
+
+    lap_video = None
+    bandpasses = filtered = None
+    # One pyramid/magnify/collapse record per call, not per frame
+    merged = {}
+
+    try:
+        for frame in frames:
+            with profiling.merged_stages(merged):
+                lap_video = pyramids.build_laplacian_video_pyramid(frame[np.newaxis], levels, dtype,
+                                                                   out=lap_video)
+                if bandpasses is None:
+                    bandpasses = [TemporalBandpass(level.shape[1:], freq_min, freq_max, fps, mode, dtype=dtype)
+                                  for level in lap_video[1:-1]]
+                    filtered = [np.empty(level.shape[1:], dtype=dtype) for level in lap_video[1:-1]]
+
+                with profiling.stage('magnify', 1):
+                    for level, bandpass, out in zip(lap_video[1:-1], bandpasses, filtered):
+                        bandpass(level[0], out=out)
+                        out *= amplification
+                        level[0] += out
+
+                magnified = pyramids.collapse_laplacian_video_pyramid_parallel(lap_video, workers=1)[0]
+            yield magnified
+    finally:
+        profiling.add_merged(merged)
@@ -0,0 +1,225 @@
+"""
+Forehead and cheek sub-ROIs of a tracked face box.
+
+Averaging the whole face rectangle mixes in hair, eyes, mouth and
+background, which carry no pulse and dilute it. The patches here are
+placed from eye, nose and mouth detections inside the face box, found once
+per face detection and then carried along by the face tracker. Per-frame
+patch means come from one integral image of the face ROI, and the patch
+traces are fused with weights proportional to their pulse SNR.
+"""
+import numpy as np
+import cv2
+
+from preprocessing import load_cascade
+
+PATCH_NAMES = ('forehead', 'left_cheek', 'right_cheek')
+
+# Landmark cascades, searched only in the part of the face box they can occupy
+EYE_CASCADE = "haarcascade_eye1"
+NOSE_CASCADE = "haarcascade_mcs_nose"
+MOUTH_CASCADE = "haarcascade_mcs_mouth"
+
+# Patches as (x, y, w, h) fractions of the face box, used when a landmark is not found
+DEFAULT_PATCHES = {
+    'forehead': (0.30, 0.08, 0.40, 0.15),
+    'left_cheek': (0.15, 0.50, 0.22, 0.20),
+    'right_cheek': (0.63, 0.50, 0.22, 0.20),
+}
+
+# Half-width of the band around the pulse peak counted as signal when scoring SNR, in Hz
+SNR_PEAK_WIDTH = 0.1
+
+
+# Largest detection of a landmark cascade inside a region of the face, in face coordinates
+def _find_landmarks(gray_face, cascade, region, min_size, max_count=1):
+    x0, y0, x1, y1 = region
+    found = load_cascade(cascade).detectMultiScale(gray_face[y0:y1, x0:x1], 1.1, 5, minSize=min_size)
+    found = sorted(found, key=lambda r: r[2] * r[3], reverse=True)[:max_count]
+    return [(x + x0, y + y0, w, h) for (x, y, w, h) in found]
+
+
+# Scale a fractional (x, y, w, h) box to pixels of a w x h face
+def _scale_box(box, face_w, face_h):
+    return (box[0] * face_w, box[1] * face_h, box[2] * face_w, box[3] * face_h)
+
+
+def locate_patches(gray_face):
+    """
+    Place the forehead and cheek patches inside a grayscale face crop.
+
+    The forehead sits above the eyes, between their outer edges. Each cheek
+    lies below an eye, between the eye's outer edge and the nose, down to
+    the top of the mouth. Patches whose landmarks are missing fall back to
+    DEFAULT_PATCHES.
+
+    Args:
+        gray_face: Grayscale face ROI
+
+    Returns:
+        (P, 4) int array of (x, y, w, h) patch boxes in face coordinates,
+        in PATCH_NAMES order
+    """
+    face_h, face_w = gray_face.shape[:2]
+    min_feature = (max(1, face_w // 10), max(1, face_h // 10))
+    boxes = {name: _scale_box(box, face_w, face_h) for name, box in DEFAULT_PATCHES.items()}
+
+    eyes = _find_landmarks(gray_face, EYE_CASCADE, (0, 0, face_w, face_h // 2), min_feature, 2)
+    noses = _find_landmarks(gray_face, NOSE_CASCADE, (face_w // 4, face_h // 3, 3 * face_w // 4, 3 * face_h // 4),
+                            min_feature)
+    mouths = _find_landmarks(gray_face, MOUTH_CASCADE, (face_w // 5, face_h // 2, 4 * face_w // 5, face_h),
+                             min_feature)
+
+    if len(eyes) == 2:
+        left, right = sorted(eyes, key=lambda r: r[0])
+        eyes_top = min(left[1], right[1])
+        eyes_bottom = max(left[1] + left[3], right[1] + right[3])
+        height = 0.6 * max(left[3], right[3])
+        top = max(0.0, eyes_top - 0.15 * left[3] - height)
+        boxes['forehead'] = (left[0], top, right[0] + right[2] - left[0], eyes_top - 0.15 * left[3] - top)
+
+        nose_left, nose_right = face_w * 0.4, face_w * 0.6
+        cheek_bottom = eyes_bottom + 0.25 * face_h
+        if noses:
+            (nx, ny, nw, nh) = noses[0]
+            nose_left, nose_right = nx, nx + nw
+            cheek_bottom = ny + nh
+        if mouths:
+            cheek_bottom = min(cheek_bottom, mouths[0][1])
+
+        cheek_top = eyes_bottom + 0.1 * left[3]
+        boxes['left_cheek'] = (left[0], cheek_top, nose_left - left[0], cheek_bottom - cheek_top)
+        boxes['right_cheek'] = (nose_right, cheek_top, right[0] + right[2] - nose_right, cheek_bottom - cheek_top)
+
+    patches = np.empty((len(PATCH_NAMES), 4), dtype=np.int64)
+    for i, name in enumerate(PATCH_NAMES):
+        (x, y, w, h) = boxes[name]
+        default = _scale_box(DEFAULT_PATCHES[name], face_w, face_h)
+        if w < 2 or h < 2:
+            (x, y, w, h) = default
+        x0, y0 = int(np.clip(round(x), 0, face_w - 1)), int(np.clip(round(y), 0, face_h - 1))
+        x1, y1 = int(np.clip(round(x + w), x0 + 1, face_w)), int(np.clip(round(y + h), y0 + 1, face_h))
+        patches[i] = (x0, y0, x1 - x0, y1 - y0)
+    return patches
+
+
+def patch_means(face_roi, patches):
+    """
+    Per-channel means of every patch of a BGR face ROI, from one integral image.
+
+    Args:
+        face_roi: (H, W, 3) face ROI
+        patches: (P, 4) patch boxes from locate_patches
+
+    Returns:
+        (P, 3) float64 array of channel means in the ROI's pixel units
+    """
+    integral = cv2.integral(face_roi, sdepth=cv2.CV_64F)
+    x0, y0 = patches[:, 0], patches[:, 1]
+    x1, y1 = x0 + patches[:, 2], y0 + patches[:, 3]
+    sums = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    return sums / (patches[:, 2] * patches[:, 3])[:, None]
+
+
+class PatchTracker:
+    """
+    Carries the patch layout along with a face tracker's box.
+
+    Landmarks are only searched when the face box changes size, which
+    happens when the face is re-detected; while the box is only moved by
+    tracking, the layout found for it is reused.
+    """
+
+    def __init__(self):
+        self.patches = None
+        self._face_size = None
+
+    def reset(self):
+        self.patches = None
+        self._face_size = None
+
+    def update(self, img, face_rect):
+        """
+        Return the (P, 3) patch means for the face at face_rect in a BGR frame.
+        """
+        (x, y, w, h) = face_rect
+        face_roi = img[y:y + h, x:x + w]
+
+        if self.patches is None or self._face_size != (w, h):
+            gray_face = cv2.cvtColor(face_roi, cv2.COLOR_BGR2GRAY)
+            self.patches = locate_patches(gray_face)
+            self._face_size = (w, h)
+
+        return patch_means(face_roi, self.patches)
+
+
+def patch_snr(traces, fps, freq_min, freq_max):
+    """
+    Pulse signal-to-noise ratio of every patch trace.
+
+    The signal is the power within SNR_PEAK_WIDTH of the strongest
+    frequency in [freq_min, freq_max], and the noise is the rest of the
+    power in that band. All patches share one rfft call.
+
+    Args:
+        traces: (P, T) patch traces
+        fps: Frames per second of the traces
+        freq_min: Minimum heart rate frequency in Hz
+        freq_max: Maximum heart rate frequency in Hz
+
+    Returns:
+        (P,) array of SNRs in dB
+    """
+    traces = np.asarray(traces, dtype=np.float64)
+    centered = traces - traces.mean(axis=1, keepdims=True)
+    power = np.abs(np.fft.rfft(centered * np.hanning(traces.shape[1]), axis=1)) ** 2
+    frequencies = np.fft.rfftfreq(traces.shape[1], d=1.0 / fps)
+
+    band = (frequencies >= freq_min) & (frequencies <= freq_max)
+    band_power = np.where(band, power, 0.0)
+    peak = frequencies[np.argmax(band_power, axis=1)]
+    near_peak = np.abs(frequencies[None, :] - peak[:, None]) <= SNR_PEAK_WIDTH
+
+    signal = np.sum(band_power * near_peak, axis=1)
+    noise = np.sum(band_power * ~near_peak, axis=1)
+    with np.errstate(divide='ignore'):
+        return 10 * np.log10(signal / np.maximum(noise, np.finfo(np.float64).tiny))
+
+
+def fuse_patch_traces(traces, fps, freq_min=1.0, freq_max=1.8, channel=1):
+    """
+    Fuse patch traces into one trace, weighting each patch by its pulse SNR.
+
+    Each patch is normalized by its mean level first, so patches of
+    different brightness contribute relative (AC/DC) changes. Weights are
+    the linear SNRs of the chosen channel, so a patch 10 dB below another
+    contributes a tenth as much.
+
+    Args:
+        traces: (P, T, 3) per-patch channel mean traces
+        fps: Frames per second of the traces
+        freq_min: Minimum heart rate frequency in Hz
+        freq_max: Maximum heart rate frequency in Hz
+        channel: Channel used to score SNR, green by default
+
+    Returns:
+        Tuple containing:
+        - trace: (T, 3) float32 fused trace at the patches' mean level
+        - weights: (P,) patch weights summing to 1
+    """
+    traces = np.asarray(traces, dtype=np.float64)
+    if traces.shape[1] < 2:
+        weights = np.full(len(traces), 1.0 / len(traces))
+        return np.tensordot(weights, traces, axes=1).astype(np.float32), weights
+
+    levels = traces.mean(axis=1, keepdims=True)
+    relative = traces / np.where(levels > 0, levels, 1.0)
+
+    snr_db = patch_snr(relative[:, :, channel], fps, freq_min, freq_max)
+    weights = np.power(10.0, snr_db / 10)
+    if not np.isfinite(weights).all() or weights.sum() <= 0:
+        weights = np.ones(len(traces))
+    weights /= weights.sum()
+
+    fused = np.tensordot(weights, relative, axes=1) * np.tensordot(weights, levels[:, 0], axes=1)
+    return fused.astype(np.float32), weights
@@ -0,0 +1,188 @@
+"""
+Memory-mapped on-disk store for recorded and uploaded sessions.
+
+File layout:
+    [JSON header, HEADER_SIZE bytes, space padded]
+    [timestamps: float64 * capacity]
+    [frames: uint8 * capacity * H * W * 3]
+
+Frames are written straight into a preallocated np.memmap, so a session
+never has to fit in RAM, and every analysis stage reads the same pages
+without copying.
+"""
+import json
+import os
+
+import numpy as np
+
+MAGIC = "hrv-frame-store"
+VERSION = 1
+HEADER_SIZE = 4096
+
+
+# ROI rectangles often come back from OpenCV as NumPy integers, which JSON rejects
+def _roi_list(roi):
+    return [int(v) for v in roi] if roi is not None else None
+
+
+class FrameStore:
+    """
+    A (capacity, H, W, 3) uint8 frame buffer backed by a memory-mapped file.
+    """
+
+    def __init__(self, path, header, mode):
+        self.path = path
+        self.mode = mode
+        self.capacity = header['capacity']
+        self.frame_shape = tuple(header['frame_shape'])
+        self.count = header['count']
+        self.metadata = header['metadata']
+
+        timestamps_bytes = self.capacity * np.dtype(np.float64).itemsize
+        self._timestamps = np.memmap(path, dtype=np.float64, mode=mode,
+                                     offset=HEADER_SIZE, shape=(self.capacity,))
+        self._frames = np.memmap(path, dtype=np.uint8, mode=mode,
+                                 offset=HEADER_SIZE + timestamps_bytes,
+                                 shape=(self.capacity,) + self.frame_shape)
+
+    @classmethod
+    def create(cls, path, capacity, frame_shape, fps, roi=None, **metadata):
+        """
+        Preallocate a store for up to `capacity` frames of shape frame_shape (H, W, 3).
+        """
+        metadata.update(fps=fps, roi=_roi_list(roi))
+        header = {
+            'magic': MAGIC,
+            'version': VERSION,
+            'capacity': int(capacity),
+            'frame_shape': [int(n) for n in frame_shape],
+            'count': 0,
+            'metadata': metadata,
+        }
+
+        # Size the file up front; most filesystems keep the unwritten part sparse
+        frame_bytes = int(np.prod(frame_shape))
+        size = HEADER_SIZE + int(capacity) * (np.dtype(np.float64).itemsize + frame_bytes)
+        with open(path, 'wb') as f:
+            f.truncate(size)
+        cls._write_header(path, header)
+
+        return cls(path, header, 'r+')
+
+    @classmethod
+    def open(cls, path, mode='r'):
+        """
+        Open an existing store, read-only by default.
+        """
+        with open(path, 'rb') as f:
+            header = json.loads(f.read(HEADER_SIZE).decode('utf-8'))
+        if header.get('magic') != MAGIC:
+            raise ValueError(f"Not a frame store: {path}")
+        return cls(path, header, mode)
+
+    @staticmethod
+    def _write_header(path, header):
+        data = json.dumps(header).encode('utf-8')
+        if len(data) > HEADER_SIZE:
+            raise ValueError("Frame store metadata does not fit in the header")
+        with open(path, 'r+b') as f:
+            f.write(data.ljust(HEADER_SIZE, b' '))
+
+    @property
+    def fps(self):
+        return self.metadata.get('fps')
+
+    @property
+    def roi(self):
+        roi = self.metadata.get('roi')
+        return tuple(roi) if roi is not None else None
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    @property
+    def frames(self):
+        """Zero-copy (count, H, W, 3) view of the stored frames."""
+        return self._frames[:self.count]
+
+    @property
+    def timestamps(self):
+        """Zero-copy (count,) view of the per-frame timestamps in seconds."""
+        return self._timestamps[:self.count]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def append(self, frame, timestamp=None):
+        """
+        Copy one frame into the next slot. Returns False when the store is full.
+        """
+        if self.full:
+            return False
+        self._frames[self.count] = frame
+        self._timestamps[self.count] = timestamp if timestamp is not None else np.nan
+        self.count += 1
+        return True
+
+    def next_slot(self):
+        """
+        Return a writable view of the next frame slot, to decode into directly.
+        Call commit() once it has been filled.
+        """
+        if self.full:
+            return None
+        return self._frames[self.count]
+
+    def commit(self, timestamp=None):
+        self._timestamps[self.count] = timestamp if timestamp is not None else np.nan
+        self.count += 1
+
+    def resized(self, path, capacity):
+        """
+        Copy the stored frames into a new store at path with room for capacity frames.
+        """
+        metadata = {k: v for k, v in self.metadata.items() if k not in ('fps', 'roi')}
+        store = FrameStore.create(path, capacity, self.frame_shape, self.fps, self.roi, **metadata)
+        count = min(self.count, store.capacity)
+        store._frames[:count] = self._frames[:count]
+        store._timestamps[:count] = self._timestamps[:count]
+        store.count = count
+        return store
+
+    def update_metadata(self, **metadata):
+        if 'roi' in metadata:
+            metadata['roi'] = _roi_list(metadata['roi'])
+        self.metadata.update(metadata)
+
+    def flush(self):
+        """
+        Write pending frames and the header (frame count, metadata) to disk.
+        """
+        if self.mode == 'r':
+            return
+        self._frames.flush()
+        self._timestamps.flush()
+        self._write_header(self.path, {
+            'magic': MAGIC,
+            'version': VERSION,
+            'capacity': self.capacity,
+            'frame_shape': list(self.frame_shape),
+            'count': self.count,
+            'metadata': self.metadata,
+        })
+
+    def close(self, delete=False):
+        """
+        Flush and release the mapping; pages stay valid while views of frames are alive.
+        """
+        self.flush()
+        del self._frames, self._timestamps
+        if delete:
+            os.remove(self.path)
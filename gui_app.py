@@ -1,17 +1,32 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import cv2
-import numpy as np
 from PIL import Image, ImageTk
 import threading
 import time
-from preprocessing import read_video
-from eulerian import fft_filter
-from heartrate import find_heart_rate
-from stress_analysis import analyze_stress_level
-from spo2_analysis import calculate_spo2, get_spo2_color
+import tempfile
+from preprocessing import ROITracker
+from online_heartrate import SlidingHeartRateEstimator
+from frame_store import FrameStore
+from ingest import VideoSource
+from capture import CaptureThread, FileLoader, FrameWorker
+from resample import estimate_fps
 import os
 
+# Uploads are decoded to fit this size and decimated to this frame rate for analysis
+ANALYSIS_SIZE = (640, 480)
+ANALYSIS_FPS = 30
+
+# Upload progress is polled at this interval instead of after every decoded frame
+LOAD_PROGRESS_MS = 100
+
+# Recording stores are sized for this multiple of the nominal frame count, and doubled
+# whenever a camera faster than it reports fills them up
+RECORDING_HEADROOM = 1.25
+
+# Camera frames are rendered at most this often; capture and analysis run at the camera rate
+DISPLAY_FPS = 30
+
 class ScrollableFrame(ttk.Frame):
     def __init__(self, container, *args, **kwargs):
         super().__init__(container, *args, **kwargs)
@@ -76,14 +91,26 @@ class HeartRateDetectorGUI:
         # Variables
         self.recording = False
         self.previewing = False
-        self.video_capture = None
+        self.capture = None
+        self.capture_worker = None
+        self.loader = None
+        self.displayed_index = None
         self.current_frame = None
         self.frames = []
+        self.frame_store = None
+        self.frame_store_dir = None
+        self.result_cache = None
         self.processing = False
         self.video_source = "webcam"
         self.current_video_size = (640, 480)
         self.recording_start_time = None
         self.recording_duration = 60  # seconds
+        self.video_fps = 30
+        self.freq_min = 1.0
+        self.freq_max = 1.8
+        self.live_estimator = None
+        self.live_tracker = None
+        self.live_heart_rate = None
         self.countdown_var = tk.StringVar(value="")
         
         # Create GUI elements
@@ -251,6 +278,12 @@ class HeartRateDetectorGUI:
                                         wraplength=400)
         self.stress_desc_label.grid(row=1, column=0, sticky="ew", padx=5)
         
+        # Rolling RMSSD over the session; falling RMSSD tracks rising stress
+        self.stress_trend_canvas = tk.Canvas(self.stress_frame, height=80, bg='#f0f0f0',
+                                             highlightthickness=0)
+        self.stress_trend_canvas.grid(row=2, column=0, sticky="ew", padx=5, pady=5)
+        self.stress_trend_canvas.grid_remove()
+        
         # Progress frame
         self.progress_frame = ttk.Frame(main_container, padding="10")
         self.progress_frame.grid(row=7, column=0, columnspan=2, sticky="ew", pady=5)
@@ -275,6 +308,12 @@ class HeartRateDetectorGUI:
         )
         self.progress_status.grid(row=1, column=0, sticky="ew")
         
+        # Cancels a background upload; only shown while one is loading
+        self.cancel_load_btn = ttk.Button(self.progress_frame, text="Cancel",
+                                          command=self.cancel_upload, style='Secondary.TButton')
+        self.cancel_load_btn.grid(row=0, column=1, rowspan=2, padx=(10, 0))
+        self.cancel_load_btn.grid_remove()
+        
         # Hide progress frame initially
         self.progress_frame.grid_remove()
         
@@ -301,8 +340,9 @@ class HeartRateDetectorGUI:
             self.setup_styles()
     
     def update_video_display(self, frame):
-        # Always flip horizontally
-        frame = cv2.flip(frame, 1)  # 1 for horizontal flip
+        # Mirror the webcam like a selfie view; frames are stored and analysed unflipped
+        if self.video_source == "webcam":
+            frame = cv2.flip(frame, 1)  # 1 for horizontal flip
         
         frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         frame_resized = cv2.resize(frame_rgb, self.current_video_size)
@@ -311,6 +351,7 @@ class HeartRateDetectorGUI:
         self.video_label.image = photo
     
     def use_webcam(self):
+        self.cancel_upload()
         self.video_source = "webcam"
         self.webcam_btn.configure(style='Primary.TButton')
         self.upload_btn.configure(style='Secondary.TButton')
@@ -329,85 +370,124 @@ class HeartRateDetectorGUI:
             self.record_button.configure(state=tk.DISABLED)
             self.process_button.configure(state=tk.NORMAL)
             
-            # Load video frames
+            # Decode in the background; the UI only polls the loader's progress
+            self.cancel_upload()
             try:
-                cap = cv2.VideoCapture(file_path)
-                if not cap.isOpened():
-                    raise Exception("Could not open video file")
-                
-                # Get video properties
-                total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-                
-                # Update status
-                self.status_var.set("Loading video frames...")
-                self.progress_frame.grid()
-                self.progress_bar["value"] = 0
-                self.root.update()
-                
-                # Clear existing frames
-                self.frames = []
-                
-                # Read frames
-                frames_read = 0
-                while True:
-                    ret, frame = cap.read()
-                    if not ret:
-                        break
-                        
-                    # Flip frame horizontally for consistency
-                    frame = cv2.flip(frame, 1)
-                    self.frames.append(frame)
-                    
-                    # Update progress
-                    frames_read += 1
-                    progress = (frames_read / total_frames) * 100
-                    self.progress_bar["value"] = progress
-                    self.status_var.set(f"Loading video: {frames_read}/{total_frames} frames")
-                    self.root.update()
-                    
-                    # Show current frame in display
-                    if frames_read == 1:
-                        self.current_frame = frame.copy()
-                        self.update_video_display(frame)
-                
-                cap.release()
-                
-                # Hide progress bar and update status
-                self.progress_frame.grid_remove()
-                self.status_var.set(f"Video loaded: {os.path.basename(file_path)} ({len(self.frames)} frames)")
-                
-            except Exception as e:
+                # Decode at the analysis resolution and frame rate, not the upload's
+                source = VideoSource(file_path, ANALYSIS_SIZE, ANALYSIS_FPS)
+            except IOError as e:
                 messagebox.showerror("Error", f"Error loading video: {str(e)}")
                 self.status_var.set("Error loading video")
-                self.progress_frame.grid_remove()
-                self.frames = []
                 self.process_button.configure(state=tk.DISABLED)
+                return
+            
+            self.close_frame_store()
+            self.current_frame = None
+            self.video_fps = source.fps
+            self.process_button.configure(state=tk.DISABLED)
+            self.status_var.set("Loading video frames...")
+            self.progress_bar["value"] = 0
+            self.progress_frame.grid()
+            self.cancel_load_btn.grid()
+            
+            # The loader owns its store until poll_upload takes it over on this thread
+            self.loader = FileLoader(source, self.new_frame_store_path())
+            self.loader.start()
+            self.root.after(LOAD_PROGRESS_MS, self.poll_upload)
+    
+    def poll_upload(self):
+        loader = self.loader
+        if loader is None:
+            return
+        
+        total = loader.total or 0
+        if loader.loaded and self.current_frame is None:
+            # Show the first frame and allow analysis to start on the frames loaded so far
+            self.current_frame = loader.store[0]
+            self.update_video_display(self.current_frame)
+            if not self.processing:
+                self.process_button.configure(state=tk.NORMAL)
+        
+        if not loader.done.is_set():
+            # Progress from processing takes over the bar while both run
+            if not self.processing:
+                if not self.progress_frame.winfo_ismapped():
+                    self.progress_frame.grid()
+                # The container's frame count is only an estimate
+                self.progress_bar["value"] = min(loader.loaded / max(total, 1) * 100, 100)
+            self.status_var.set(f"Loading video: {loader.loaded}/{total} frames")
+            self.root.after(LOAD_PROGRESS_MS, self.poll_upload)
+            return
+        
+        failed = loader.error is not None or loader.cancelled
+        if failed and self.processing:
+            # The analysis is still reading the loader's frames; discard them once it stops
+            self.root.after(LOAD_PROGRESS_MS, self.poll_upload)
+            return
+        
+        self.loader = None
+        self.cancel_load_btn.grid_remove()
+        if not self.processing:
+            self.progress_frame.grid_remove()
+        
+        if failed:
+            loader.discard()
+            self.process_button.configure(state=tk.DISABLED)
+            if loader.error is not None:
+                messagebox.showerror("Error", f"Error loading video: {str(loader.error)}")
+                self.status_var.set("Error loading video")
+            else:
+                self.status_var.set("Loading cancelled")
+        else:
+            self.frame_store = loader.store
+            self.frames = self.frame_store.frames if self.frame_store is not None else []
+            self.status_var.set(f"Video loaded: {os.path.basename(self.video_path)} ({len(self.frames)} frames)")
+    
+    def cancel_upload(self):
+        if self.loader is not None:
+            self.loader.cancel()
+            self.poll_upload()
     
     def toggle_preview(self):
         if not self.recording:  # Don't allow preview while recording
             if not self.previewing:
-                self.video_capture = cv2.VideoCapture(0)
-                if not self.video_capture.isOpened():
-                    messagebox.showerror("Error", "Could not open video capture device")
+                try:
+                    # Preview only displays frames, so the capture thread needs no queue
+                    self.capture = CaptureThread(0, queue_size=0)
+                except IOError as e:
+                    messagebox.showerror("Error", str(e))
                     return
+                self.capture.start()
                 self.previewing = True
                 self.preview_btn.configure(text="Stop Preview", style='Primary.TButton')
-                self.update_preview()
+                self.update_display()
             else:
                 self.previewing = False
-                if self.video_capture is not None:
-                    self.video_capture.release()
+                self.stop_capture()
                 self.preview_btn.configure(text="Preview Camera", style='Secondary.TButton')
                 # Clear the video display
                 self.video_label.configure(image='')
     
-    def update_preview(self):
-        if self.previewing and self.video_capture is not None:
-            ret, frame = self.video_capture.read()
-            if ret:
-                self.current_frame = frame.copy()
-                self.update_video_display(frame)
-            self.root.after(10, self.update_preview)
+    def update_display(self):
+        # Render only the latest captured frame, at most DISPLAY_FPS times a second
+        if self.capture is None or not (self.previewing or self.recording):
+            return
+        
+        latest = self.capture.latest()
+        if latest is not None and latest[2] != self.displayed_index:
+            (frame, timestamp, self.displayed_index) = latest
+            self.current_frame = frame
+            self.update_video_display(frame)
+        
+        if self.recording:
+            if self.live_heart_rate is not None:
+                self.result_label.configure(text=f"Heart Rate: {self.live_heart_rate:.1f} BPM (live)")
+            if self.capture_worker is not None and self.capture_worker.done.is_set():
+                # The worker failed
+                self.stop_recording()
+                return
+        
+        self.root.after(int(1000 / DISPLAY_FPS), self.update_display)
     
     def toggle_recording(self):
         if not self.recording and self.video_source == "webcam":
@@ -415,32 +495,67 @@ class HeartRateDetectorGUI:
             if self.previewing:
                 self.toggle_preview()
             
-            self.video_capture = cv2.VideoCapture(0)
-            if not self.video_capture.isOpened():
-                messagebox.showerror("Error", "Could not open video capture device")
+            try:
+                self.capture = CaptureThread(0)
+            except IOError as e:
+                messagebox.showerror("Error", str(e))
                 return
             
             self.recording = True
-            self.frames = []
+            self.video_fps = self.capture.fps
+            # Created here on the Tk thread; the worker appends to it and grows it when full
+            capacity = int(self.recording_duration * self.video_fps * RECORDING_HEADROOM) + 1
+            self.create_frame_store(self.capture.frame_shape, capacity, self.video_fps)
+            self.live_estimator = SlidingHeartRateEstimator(self.video_fps, self.freq_min, self.freq_max)
+            self.live_tracker = ROITracker()
+            self.live_heart_rate = None
             self.recording_start_time = time.time()
+            
+            # Storage and live analysis run on a worker fed by the capture queue
+            self.capture_worker = FrameWorker(self.capture.frames, self.record_frame)
+            self.capture_worker.start()
+            self.capture.start()
+            
             self.record_button.configure(text="Recording...", state=tk.DISABLED)
             self.process_button.configure(state=tk.DISABLED)
             self.preview_btn.configure(state=tk.DISABLED)
             self.status_var.set("Recording...")
-            self.update_video_feed()
+            self.update_display()
             self.update_countdown()
         else:
             self.stop_recording()
 
+    def stop_capture(self):
+        if self.capture is not None:
+            self.capture.stop()
+            self.capture = None
+        # The capture thread ends the queue on exit, so the worker drains what is left and returns
+        if self.capture_worker is not None:
+            self.capture_worker.join()
+            error = self.capture_worker.error
+            self.capture_worker = None
+            if error is not None:
+                messagebox.showerror("Error", f"Error during recording: {str(error)}")
+        self.displayed_index = None
+
     def stop_recording(self):
+        if not self.recording:
+            return
         self.recording = False
-        if self.video_capture is not None:
-            self.video_capture.release()
-            self.video_capture = None
+        dropped = self.capture.dropped if self.capture is not None else 0
+        self.stop_capture()
+        if self.frame_store is not None:
+            self.frame_store.flush()
+            self.frames = self.frame_store.frames
+            # The camera's nominal rate is often wrong; analyse at the rate frames actually arrived
+            self.video_fps = estimate_fps(self.frame_store.timestamps) or self.video_fps
         self.record_button.configure(text="Start Recording", style='Primary.TButton', state=tk.NORMAL)
         self.process_button.configure(text="Process Video", style='Primary.TButton', state=tk.NORMAL)
         self.preview_btn.configure(state=tk.NORMAL)
-        self.status_var.set("Recording completed - Ready to process")
+        status = "Recording completed - Ready to process"
+        if dropped:
+            status += f" ({dropped} frames dropped)"
+        self.status_var.set(status)
         self.countdown_var.set("")
 
     def update_countdown(self):
@@ -453,26 +568,60 @@ class HeartRateDetectorGUI:
                 self.root.after(100, self.update_countdown)
             else:
                 self.stop_recording()
-                self.status_var.set("Recording completed - Ready to process")
     
-    def update_video_feed(self):
-        if self.recording and self.video_capture is not None:
-            ret, frame = self.video_capture.read()
-            if ret:
-                self.current_frame = frame.copy()
-                
-                # Always flip horizontally
-                frame = cv2.flip(frame, 1)
-                
-                # Store the flipped frame
-                self.frames.append(frame)
-                
-                # Display frame
-                self.update_video_display(self.current_frame)
-            self.root.after(10, self.update_video_feed)
+    def record_frame(self, frame, timestamp):
+        # Runs on the capture worker thread; must not touch Tk widgets, and of the
+        # GUI state only replaces the recording store when it grows
+        # Store the frame on disk; mirroring is only applied for display
+        if self.frame_store.full:
+            self.grow_recording_store()
+        self.frame_store.append(frame, timestamp)
+        
+        # Feed the live estimator with the face ROI
+        self.update_live_heart_rate(frame, timestamp)
+    
+    def grow_recording_store(self):
+        # Runs on the capture worker; the Tk thread only reads the store once the worker has joined
+        old = self.frame_store
+        self.frame_store = old.resized(f"{old.path}.{old.capacity * 2}", old.capacity * 2)
+        old.close(delete=True)
+    
+    def new_frame_store_path(self):
+        # Sessions live in a memory-mapped file so long recordings don't have to fit in RAM
+        if self.frame_store_dir is None:
+            self.frame_store_dir = tempfile.mkdtemp(prefix="hrv_frames_")
+        return os.path.join(self.frame_store_dir, f"session_{int(time.time() * 1000)}.frames")
+    
+    def create_frame_store(self, frame_shape, capacity, fps):
+        self.close_frame_store()
+        self.frame_store = FrameStore.create(self.new_frame_store_path(), capacity, frame_shape, fps)
+        return self.frame_store
+    
+    def close_frame_store(self):
+        self.frames = []
+        if self.frame_store is not None:
+            self.frame_store.close(delete=True)
+            self.frame_store = None
+    
+    def update_live_heart_rate(self, frame, timestamp):
+        if self.live_estimator is None:
+            return
+        
+        # Track the face so the ROI follows the subject during the recording
+        face_rect = self.live_tracker.update(frame)
+        if face_rect is None:
+            return
+        
+        (x, y, w, h) = face_rect
+        # Timestamped, so the estimator corrects for the camera's real, irregular rate
+        heart_rate = self.live_estimator.push_frame(frame[y:y + h, x:x + w], timestamp)
+        if heart_rate is not None:
+            # Picked up by update_display on the Tk thread
+            self.live_heart_rate = heart_rate
     
     def process_video(self):
-        if not self.frames:
+        loader = self.loader
+        if len(self.frames) == 0 and not (loader is not None and loader.loaded):
             messagebox.showerror("Error", "No video recorded or loaded")
             return
         
@@ -480,29 +629,124 @@ class HeartRateDetectorGUI:
         self.process_button.configure(state=tk.DISABLED)
         self.upload_btn.configure(state=tk.DISABLED)
         self.record_button.configure(state=tk.DISABLED)
+        self.progress_bar["value"] = 0
+        self.progress_frame.grid()
         
         def process():
             try:
-                # Calculate heart rate
-                heart_rate = find_heart_rate(self.frames)
+                # The analysis stack (scipy and friends) is only loaded when first needed
+                import profiling
+                from pipeline import analyze_frames
+                from result_cache import ResultCache, file_digest
+                from stress_analysis import analyze_stress_level
+                from spo2_analysis import calculate_spo2
+                
+                # Calculate heart rate, reporting per-stage progress to the UI
+                profiler = profiling.Profiler()
+                profiler.add_listener(self.on_stage_event)
+                
+                # Re-processing the same upload with the same band is served from the cache;
+                # webcam sessions can never be looked up again, so they are not cached
+                if self.result_cache is None:
+                    self.result_cache = ResultCache()
+                if self.video_source == "file":
+                    source_hash = file_digest(self.video_path)
+                else:
+                    source_hash = None
+                
+                with profiling.profile(profiler):
+                    if loader is not None:
+                        # Still loading: analyse frames as they arrive
+                        result = analyze_frames(loader.iter_frames(), self.video_fps, self.freq_min,
+                                                self.freq_max, self.result_cache, source_hash,
+                                                timestamps=loader.timestamps, total=loader.total)
+                        # SpO2 and stress need the whole clip, also after a cache hit that read no frames;
+                        # poll_upload hands the store over to the GUI, so it is only read here
+                        for _ in loader.iter_frames():
+                            pass
+                        frames = loader.store.frames
+                    else:
+                        frames = self.frames
+                        result = analyze_frames(frames, self.video_fps, self.freq_min, self.freq_max,
+                                                self.result_cache, source_hash,
+                                                timestamps=self.frame_store.timestamps)
+                heart_rate = result['heart_rate']
+                self.root.after(0, lambda: self.update_hrv_results(result['hrv_metrics']))
                 
                 # Calculate SpO₂
-                spo2, ratio = calculate_spo2(self.frames)
+                spo2, ratio = calculate_spo2(frames)
                 
                 # Calculate stress level
-                stress_level = analyze_stress_level(self.frames)
+                stress_level = analyze_stress_level(frames)
                 
                 self.root.after(0, lambda: self.update_results(heart_rate, stress_level, spo2))
             except Exception as e:
                 self.root.after(0, lambda: messagebox.showerror("Error", str(e)))
             finally:
                 self.processing = False
+                self.root.after(0, self.progress_frame.grid_remove)
                 self.root.after(0, lambda: self.process_button.configure(state=tk.NORMAL))
                 self.root.after(0, lambda: self.upload_btn.configure(state=tk.NORMAL))
                 self.root.after(0, lambda: self.record_button.configure(state=tk.NORMAL))
         
         threading.Thread(target=process, daemon=True).start()
     
+    def on_stage_event(self, event, record):
+        # Called from the processing thread; hand a copy over to the Tk thread
+        record = dict(record)
+        self.root.after(0, lambda: self.show_stage_progress(event, record))
+    
+    def show_stage_progress(self, event, record):
+        name = record['name'].replace('_', ' ')
+        total = record['total_frames']
+        
+        if event == 'end':
+            self.progress_status.configure(text=f"{name}: done in {record['wall']:.2f}s")
+            if total:
+                self.progress_bar["value"] = 100
+        elif total:
+            self.progress_bar["value"] = (record['frames'] / total) * 100
+            self.progress_status.configure(text=f"{name}: {record['frames']}/{total} frames")
+        else:
+            self.progress_status.configure(text=f"{name}...")
+    
+    def update_hrv_results(self, hrv_metrics):
+        if hrv_metrics['valid']:
+            self.sdnn_label.configure(text=f"SDNN: {hrv_metrics['sdnn']:.1f} ms")
+            self.rmssd_label.configure(text=f"RMSSD: {hrv_metrics['rmssd']:.1f} ms")
+        else:
+            self.sdnn_label.configure(text="SDNN: -- ms")
+            self.rmssd_label.configure(text="RMSSD: -- ms")
+        self.update_stress_trend(hrv_metrics.get('trend'))
+    
+    def update_stress_trend(self, trend):
+        canvas = self.stress_trend_canvas
+        canvas.delete("all")
+        
+        # Results cached before trends were computed have none
+        points = [(t, v) for t, v in zip(trend['time'], trend['rmssd']) if v == v] if trend else []
+        if len(points) < 2:
+            canvas.grid_remove()
+            return
+        canvas.grid()
+        canvas.update_idletasks()
+        
+        width = max(canvas.winfo_width(), 200)
+        height = int(canvas['height'])
+        pad = 10
+        t0, t1 = points[0][0], points[-1][0]
+        v_min = min(v for _, v in points)
+        v_max = max(v for _, v in points)
+        v_range = (v_max - v_min) or 1.0
+        
+        coords = []
+        for t, v in points:
+            coords.append(pad + (t - t0) / (t1 - t0) * (width - 2 * pad))
+            coords.append(height - pad - (v - v_min) / v_range * (height - 2 * pad))
+        canvas.create_line(*coords, fill='#2196F3', width=2)
+        canvas.create_text(pad, pad, anchor="nw", fill='#616161',
+                           text=f"RMSSD {v_min:.0f}–{v_max:.0f} ms over {t1:.0f}s")
+    
     def update_results(self, heart_rate, stress_level, spo2=None):
         if heart_rate is not None:
             self.result_label.configure(text=f"Heart Rate: {heart_rate:.1f} BPM")
@@ -515,6 +759,7 @@ class HeartRateDetectorGUI:
             self.stress_level_label.configure(text="Stress Level: Failed to detect")
             
         if spo2 is not None:
+            from spo2_analysis import get_spo2_color
             color = get_spo2_color(spo2)
             self.spo2_label.configure(
                 text=f"SpO₂: {spo2:.1f}%",
@@ -1,12 +1,18 @@
-from scipy import signal
 import numpy as np
+
+import profiling
 from hrv_analysis import analyze_hrv
 
 
-def find_heart_rate(filtered_signal, frequencies, freq_min, freq_max):
+@profiling.profiled('heart_rate')
+def find_heart_rate(filtered_signal, frequencies, freq_min, freq_max, frame_ct=None):
     """
     Calculate heart rate and HRV metrics from the filtered signal.
     Uses memory-efficient processing by working with the already filtered signal.
+    
+    filtered_signal is the band-passed rfft spectrum from eulerian.fft_filter.
+    HRV is computed on the pulse waveform recovered from it; frame_ct trims
+    the FFT zero-padding off that waveform.
     """
     # Convert to magnitude spectrum
     magnitude_spectrum = np.abs(filtered_signal)
@@ -27,9 +33,16 @@ def find_heart_rate(filtered_signal, frequencies, freq_min, freq_max):
     heart_rate_freq = valid_frequencies[max_magnitude_idx]
     heart_rate = heart_rate_freq * 60
     
-    # Calculate HRV metrics using the filtered signal
-    sampling_rate = 1.0 / (frequencies[1] - frequencies[0])  # Hz
-    hrv_metrics = analyze_hrv(magnitude_spectrum, sampling_rate)
+    # Recover the band-passed pulse waveform; fft_filter pads to an even
+    # length, so the spectrum ends at Nyquist and fps is twice its last bin
+    nfft = 2 * (len(frequencies) - 1)
+    sampling_rate = 2 * frequencies[-1]  # Hz
+    pulse_signal = np.fft.irfft(filtered_signal, n=nfft)
+    if frame_ct is not None:
+        pulse_signal = pulse_signal[:frame_ct]
+    
+    # Calculate HRV metrics from beats detected in the pulse waveform
+    hrv_metrics = analyze_hrv(pulse_signal, sampling_rate)
     
     return {
         'heart_rate': round(heart_rate, 1),
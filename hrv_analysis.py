@@ -1,27 +1,75 @@
 import numpy as np
-from scipy import signal, interpolate
 import warnings
 
-def extract_rr_intervals(heart_rate_signal, sampling_rate):
+import profiling
+
+# Points per sample at which the spline is evaluated around each peak
+REFINE_POINTS = 21
+
+# Default rolling HRV window and hop, in seconds
+ROLLING_WINDOW_SECONDS = 30.0
+ROLLING_STEP_SECONDS = 5.0
+
+
+def detect_beats(pulse_signal, sampling_rate, min_rr=0.33, refine=True):
     """
-    Extract RR intervals from the heart rate signal using peak detection.
+    Detect heartbeats in a band-passed pulse waveform.
+    
+    Peaks are found at the native sampling rate, then each one is refined to
+    sub-sample precision on a cubic spline of the waveform. The spline is
+    only evaluated on a small grid around each peak, all peaks at once, so
+    hour-long traces take milliseconds.
     
     Args:
-        heart_rate_signal: Array of heart rate values over time
+        pulse_signal: Band-passed pulse waveform, one sample per frame
         sampling_rate: Sampling rate of the signal in Hz
+        min_rr: Shortest allowed interval between beats in seconds
+        refine: Refine peak times with the cubic spline
+    
+    Returns:
+        beat_times: Array of beat times in seconds
+    """
+    # scipy is imported lazily so headless workers only load it when HRV is computed
+    from scipy import signal, interpolate
+
+    pulse_signal = np.asarray(pulse_signal, dtype=np.float64)
+    distance = max(1, int(sampling_rate * min_rr))
+    peaks, _ = signal.find_peaks(pulse_signal, height=0, distance=distance)
+    
+    if not refine or len(peaks) == 0 or len(pulse_signal) < 4:
+        return peaks / sampling_rate
+    
+    # Evaluate the spline on a grid spanning one sample either side of every peak
+    spline = interpolate.CubicSpline(np.arange(len(pulse_signal)), pulse_signal)
+    offsets = np.linspace(-1.0, 1.0, REFINE_POINTS)
+    grid = np.clip(peaks[:, None] + offsets[None, :], 0, len(pulse_signal) - 1)
+    values = spline(grid.ravel()).reshape(grid.shape)
+    refined = grid[np.arange(len(peaks)), np.argmax(values, axis=1)]
+    
+    return refined / sampling_rate
+
+def extract_rr_intervals(heart_rate_signal, sampling_rate, min_rr=0.33, beat_times=None):
+    """
+    Extract RR intervals from the pulse waveform using peak detection.
+    
+    Args:
+        heart_rate_signal: Band-passed pulse waveform over time
+        sampling_rate: Sampling rate of the signal in Hz
+        min_rr: Shortest allowed interval between beats in seconds
+        beat_times: Beat times already found by detect_beats, detected here if None
     
     Returns:
         rr_intervals: Array of RR intervals in milliseconds
     """
-    # Find peaks in the heart rate signal
-    peaks, _ = signal.find_peaks(heart_rate_signal, distance=int(sampling_rate * 0.5))
+    if beat_times is None:
+        beat_times = detect_beats(heart_rate_signal, sampling_rate, min_rr)
     
-    if len(peaks) < 2:
+    if len(beat_times) < 2:
         warnings.warn("Not enough peaks detected for HRV analysis")
         return np.array([])
     
     # Calculate RR intervals in milliseconds
-    rr_intervals = np.diff(peaks) * (1000 / sampling_rate)
+    rr_intervals = np.diff(beat_times) * 1000
     return rr_intervals
 
 def compute_hrv_metrics(rr_intervals):
@@ -54,17 +102,105 @@ def compute_hrv_metrics(rr_intervals):
         'valid': True
     }
 
-def analyze_hrv(heart_rate_signal, sampling_rate):
+def rolling_hrv(beat_times, window_seconds=ROLLING_WINDOW_SECONDS, step_seconds=ROLLING_STEP_SECONDS):
+    """
+    Compute SDNN, RMSSD and mean heart rate over sliding windows of beats.
+    
+    Running sums and sums of squares of the RR intervals and their successive
+    differences are kept as prefix sums, so each window adds the intervals
+    entering it and subtracts those leaving it. The cost is O(beats + windows)
+    whatever the window length, which keeps hour-long sessions cheap.
+    
+    An RR interval belongs to the window its closing beat falls in, and a
+    successive difference to the window holding both of its intervals.
+    
+    Args:
+        beat_times: Sorted beat times in seconds
+        window_seconds: Window length in seconds
+        step_seconds: Hop between window starts in seconds
+    
+    Returns:
+        dict: Arrays 'start', 'end', 'count', 'mean_hr', 'sdnn', 'rmssd' and
+        'valid', one entry per window
+    """
+    beat_times = np.asarray(beat_times, dtype=np.float64)
+    if len(beat_times) < 2:
+        empty = np.array([])
+        return {'start': empty, 'end': empty, 'count': empty.astype(np.int64),
+                'mean_hr': empty, 'sdnn': empty, 'rmssd': empty, 'valid': empty.astype(bool)}
+    
+    rr_times = beat_times[1:]
+    rr = np.diff(beat_times) * 1000
+    # Centre before squaring so the sums of squares keep their precision
+    centered = rr - rr.mean()
+    diffs = np.diff(rr)
+    
+    def prefix(values):
+        out = np.zeros(len(values) + 1)
+        np.cumsum(values, out=out[1:])
+        return out
+    
+    rr_sum, rr_sq_sum = prefix(centered), prefix(centered ** 2)
+    diff_sq_sum = prefix(diffs ** 2)
+    
+    # Windows start at the first beat; a final partial window is dropped
+    # unless the recording is shorter than one window
+    span = beat_times[-1] - beat_times[0]
+    n_windows = max(int(np.floor((span - window_seconds) / step_seconds)) + 1, 1)
+    starts = beat_times[0] + np.arange(n_windows) * step_seconds
+    ends = starts + window_seconds
+    
+    # Interval index range [lo, hi) inside each window
+    lo = np.searchsorted(rr_times, starts, side='left')
+    hi = np.searchsorted(rr_times, ends, side='left')
+    count = hi - lo
+    diff_count = np.maximum(count - 1, 0)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = (rr_sum[hi] - rr_sum[lo]) / count
+        variance = (rr_sq_sum[hi] - rr_sq_sum[lo]) / count - mean ** 2
+        sdnn = np.sqrt(np.maximum(variance, 0))
+        rmssd = np.sqrt((diff_sq_sum[lo + diff_count] - diff_sq_sum[lo]) / diff_count)
+        mean_hr = 60000 / (mean + rr.mean())
+    
+    valid = count >= 2
+    return {
+        'start': starts,
+        'end': ends,
+        'count': count,
+        'mean_hr': np.where(count > 0, mean_hr, np.nan),
+        'sdnn': np.where(valid, sdnn, np.nan),
+        'rmssd': np.where(valid, rmssd, np.nan),
+        'valid': valid,
+    }
+
+@profiling.profiled('hrv')
+def analyze_hrv(heart_rate_signal, sampling_rate, window_seconds=ROLLING_WINDOW_SECONDS,
+                step_seconds=ROLLING_STEP_SECONDS):
     """
     Perform complete HRV analysis on the heart rate signal.
     
     Args:
-        heart_rate_signal: Array of heart rate values over time
+        heart_rate_signal: Band-passed pulse waveform over time
         sampling_rate: Sampling rate of the signal in Hz
+        window_seconds: Rolling window length in seconds, None to skip the trend
+        step_seconds: Hop between rolling windows in seconds
     
     Returns:
-        dict: Dictionary containing HRV metrics
+        dict: Dictionary containing HRV metrics; 'rr_intervals' (ms) and
+        'trend' (the rolling metrics) are lists, so results stay JSON-serializable
     """
-    rr_intervals = extract_rr_intervals(heart_rate_signal, sampling_rate)
+    beat_times = detect_beats(heart_rate_signal, sampling_rate)
+    rr_intervals = extract_rr_intervals(heart_rate_signal, sampling_rate, beat_times=beat_times)
     hrv_metrics = compute_hrv_metrics(rr_intervals)
+    hrv_metrics['rr_intervals'] = np.round(rr_intervals, 2).tolist()
+    
+    if window_seconds is not None:
+        trend = rolling_hrv(beat_times, window_seconds, step_seconds)
+        hrv_metrics['trend'] = {
+            'time': np.round(trend['end'], 2).tolist(),
+            'mean_hr': np.round(trend['mean_hr'], 1).tolist(),
+            'sdnn': np.round(trend['sdnn'], 2).tolist(),
+            'rmssd': np.round(trend['rmssd'], 2).tolist(),
+        }
     return hrv_metrics
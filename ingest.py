@@ -0,0 +1,137 @@
+"""
+Video ingestion: decode, decimate and downscale frames for analysis.
+
+Analysis needs neither full resolution nor every frame of a 1080p60 upload:
+the pulse lives well below 15 Hz and is a spatial mean over the face. The
+VideoSource here
+
+    - decimates to a target fps by keeping every n-th frame; skipped frames
+      are only grabbed (demuxed and decoded, but never converted to BGR or
+      copied out of the decoder),
+    - stamps every kept frame with its presentation time, so variable frame
+      rate files and decimation keep their real timing (see resample),
+    - downscales kept frames to fit a target analysis size,
+    - decodes and resizes into a small ring of preallocated buffers, so the
+      loop does not allocate per frame.
+"""
+import cv2
+import numpy as np
+
+
+class FramePool:
+    """
+    Ring of preallocated frame buffers.
+
+    A buffer handed out by next() is reused `size` calls later, so callers
+    that keep frames longer than that must copy them.
+    """
+
+    def __init__(self, shape, size=2, dtype=np.uint8):
+        self.buffers = [np.empty(shape, dtype=dtype) for _ in range(size)]
+        self._next = 0
+
+    @property
+    def shape(self):
+        return self.buffers[0].shape
+
+    def next(self):
+        buffer = self.buffers[self._next]
+        self._next = (self._next + 1) % len(self.buffers)
+        return buffer
+
+
+# Output (width, height) fitting a frame inside target_size without upscaling, keeping the aspect ratio
+def fit_size(width, height, target_size):
+    if target_size is None:
+        return width, height
+    scale = min(target_size[0] / width, target_size[1] / height, 1.0)
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+
+class VideoSource:
+    """
+    Iterates over the (frame, timestamp) pairs of a video at a reduced
+    resolution and frame rate.
+
+    Frames come from a FramePool and are only valid for pool_size
+    iterations; copy them to keep them longer.
+    """
+
+    def __init__(self, path, target_size=None, target_fps=None, pool_size=2):
+        """
+        Args:
+            path: Path to the video file (or a camera index)
+            target_size: (width, height) box frames are downscaled to fit, None for native size
+            target_fps: Keep about this many frames per second, None for every frame
+            pool_size: Number of reusable output buffers
+        """
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise IOError(f"Could not open video file: {path}")
+
+        self.native_fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.stride = 1
+        if target_fps and target_fps < self.native_fps:
+            self.stride = max(1, int(round(self.native_fps / target_fps)))
+        self.fps = self.native_fps / self.stride
+
+        native_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.frame_count = -(-native_count // self.stride) if native_count > 0 else None
+
+        self.native_size = (int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                            int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self.target_size = target_size
+        self.pool_size = pool_size
+        self.frame_size = fit_size(*self.native_size, target_size) if all(self.native_size) else None
+
+    def __iter__(self):
+        decoded = resized = None
+        index = 0
+        last_timestamp = -np.inf
+
+        try:
+            while self.cap.isOpened():
+                # Skipped frames are grabbed but never retrieved
+                if index % self.stride:
+                    if not self.cap.grab():
+                        break
+                    index += 1
+                    continue
+                if not self.cap.grab():
+                    break
+
+                if decoded is None:
+                    # The first frame sizes the buffer pools
+                    ret, frame = self.cap.retrieve()
+                    if not ret:
+                        break
+                    (height, width) = frame.shape[:2]
+                    self.native_size = (width, height)
+                    self.frame_size = fit_size(width, height, self.target_size)
+                    if self.frame_size == self.native_size:
+                        decoded = FramePool(frame.shape, self.pool_size)
+                    else:
+                        # Decoded frames are resized straight away, so one decode buffer is enough
+                        decoded = FramePool(frame.shape, 1)
+                        resized = FramePool((self.frame_size[1], self.frame_size[0], 3), self.pool_size)
+                else:
+                    ret, frame = self.cap.retrieve(decoded.next())
+                    if not ret:
+                        break
+
+                if resized is not None:
+                    frame = cv2.resize(frame, self.frame_size, dst=resized.next(), interpolation=cv2.INTER_AREA)
+
+                # Fall back to the nominal rate where the backend reports no usable position
+                timestamp = self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                if not timestamp > last_timestamp:
+                    timestamp = last_timestamp + self.stride / self.native_fps if index else 0.0
+                last_timestamp = timestamp
+
+                yield frame, timestamp
+                index += 1
+        finally:
+            self.release()
+
+    def release(self):
+        self.cap.release()
@@ -1,46 +1,147 @@
+import argparse
+import sys
+
 import cv2
+import numpy as np
+
 import pyramids
-import heartrate
 import preprocessing
 import eulerian
+from pipeline import analyze_trace
+from result_cache import ResultCache, file_digest
+from signal_extraction import extract_channel_means
+from signal_methods import DEFAULT_METHOD, SIGNAL_METHODS
+from resample import resample_uniform
 
 # Frequency range for Fast-Fourier Transform
 freq_min = 1
 freq_max = 1.8
 
-# Preprocessing phase
-print("Reading + preprocessing video...")
-video_frames, frame_ct, fps = preprocessing.read_video("videos/rohin_active.mov")
+parser = argparse.ArgumentParser(description="Estimate heart rate from a face video")
+parser.add_argument('video', nargs='?', default="videos/rohin_active.mov", help="Input video")
+parser.add_argument('--method', choices=sorted(SIGNAL_METHODS), default=DEFAULT_METHOD, help="Pulse signal method")
+parser.add_argument('--output', help="Write the Eulerian-magnified video here")
+parser.add_argument('--show', action='store_true', help="Display the Eulerian-magnified video")
+parser.add_argument('--amplification', type=float, default=50, help="Magnification gain")
+parser.add_argument('--dtype', choices=['float32', 'float64'], default='float32',
+                    help="Working precision of the magnification frames, pyramid and filtering")
+parser.add_argument('--temporal-filter', choices=eulerian.TEMPORAL_FILTERS, default='fft',
+                    help="fft band-passes whole pyramid levels in memory; "
+                         "butter and difference are causal IIR filters that stream frame by frame")
+parser.add_argument('--cache-dir', help="Reuse traces/spectra/results cached in this directory")
+parser.add_argument('--cache-max-mb', type=int, default=1024, help="Cache size limit in MB")
+args = parser.parse_args()
 
-# Build Laplacian video pyramid
-print("Building Laplacian video pyramid...")
-lap_video = pyramids.build_video_pyramid(video_frames)
+cache = None
+source_hash = None
+if args.cache_dir:
+    cache = ResultCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+    source_hash = file_digest(args.video)
+# Same keys as pipeline.analyze_video, so main.py and batch_process.py share cache entries
+trace_params = {'skin_mask': False}
+band_params = dict(trace_params, freq_min=float(freq_min), freq_max=float(freq_max), method=args.method)
 
-amplified_video_pyramid = []
+# Magnification is only needed to render a video; heart rate comes from the ROI mean trace
+magnify = bool(args.output or args.show)
+# Causal filters magnify each frame as it is decoded, so the clip is never held in memory
+stream = magnify and args.temporal_filter != 'fft'
+
+result = None
+trace = None
+if cache is not None and not magnify:
+    # Without magnification the frames are only needed for the trace, so a cache hit skips decoding
+    result = cache.get('heart_rate', source_hash, **band_params)
+    artifact = cache.get('trace', source_hash, **trace_params) if result is None else None
+    if artifact is not None:
+        trace, fps = artifact['trace'], float(artifact['fps'])
+
+# Preprocessing phase
+timestamps = []
+if result is not None or trace is not None:
+    print("Using cached analysis...")
+elif stream:
+    print("Reading + preprocessing video...")
+    video_frames, fps = preprocessing.stream_video(args.video, dtype=args.dtype, timestamps=timestamps)
+    means = []
 
-for i, video in enumerate(lap_video):
-    if i == 0 or i == len(lap_video)-1:
-        continue
+    # Keep the ROI means for the heart rate while the frames go through magnification
+    def keep_means(frames):
+        for frame in frames:
+            means.append(cv2.mean(frame)[:3])
+            yield frame
 
-    # Eulerian magnification with temporal FFT filtering
-    print("Running FFT and Eulerian magnification...")
-    result, fft, frequencies = eulerian.fft_filter(video, freq_min, freq_max, fps)
-    lap_video[i] += result
+    print("Running streaming Eulerian magnification...")
+    writer = None
+    for frame in eulerian.iter_magnified_frames(keep_means(video_frames), freq_min, freq_max, fps,
+                                                args.amplification, mode=args.temporal_filter,
+                                                dtype=args.dtype):
+        if args.output:
+            if writer is None:
+                (height, width) = frame.shape[:2]
+                writer = cv2.VideoWriter(args.output, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+            writer.write(frame)
+        if args.show:
+            cv2.imshow("frame", frame)
+            cv2.waitKey(1)
+    if writer is not None:
+        writer.release()
+    trace = np.asarray(means, dtype=np.float32).reshape(-1, 3)
+elif magnify:
+    print("Reading + preprocessing video...")
+    video_frames, fps = preprocessing.stream_video(args.video, dtype=args.dtype, timestamps=timestamps)
+    video_frames = list(video_frames)
+    if not video_frames:
+        sys.exit(f"No face detected in {args.video}")
+    video = np.stack(video_frames)
+    del video_frames
+    trace = extract_channel_means(video)
+else:
+    print("Reading + preprocessing video...")
+    # Only channel means are needed, so the ROIs are averaged without resizing them
+    video_frames, fps = preprocessing.stream_video(args.video, dtype=np.uint8, timestamps=timestamps,
+                                                   roi_size=None)
+    trace = extract_channel_means(video_frames)
+if result is None and len(trace) < 2:
+    sys.exit(f"No face detected in {args.video}")
+if timestamps:
+    # The video was decoded above. Frames without a face and variable frame rates
+    # leave uneven gaps, so filter on a uniform grid
+    trace, fps = resample_uniform(trace, timestamps, fps)
+    if cache is not None:
+        cache.put('trace', source_hash, {'trace': trace, 'fps': np.array(fps)}, **trace_params)
 
-    # Calculate heart rate
-    print("Calculating heart rate...")
-    heart_rate = heartrate.find_heart_rate(fft, frequencies, freq_min, freq_max)
+# Calculate heart rate
+print("Calculating heart rate...")
+if result is None:
+    result = analyze_trace(trace, fps, freq_min, freq_max, cache, source_hash, band_params, args.method)
+print("Heart rate: ", result['heart_rate'], "bpm")
 
-# Collapse laplacian pyramid to generate final video
-print("Rebuilding final video...")
-amplified_frames = pyramids.collapse_laplacian_video_pyramid(lap_video, frame_ct)
+if magnify and not stream:
+    # Build Laplacian video pyramid
+    print("Building Laplacian video pyramid...")
+    lap_video = pyramids.build_laplacian_video_pyramid(video, dtype=args.dtype)
 
-# Output heart rate and final video
-print("Heart rate: ", heart_rate, "bpm")
-print("Displaying final video...")
+    # Eulerian magnification with temporal FFT filtering of every pixel
+    print("Running Eulerian magnification...")
+    for i, level in enumerate(lap_video):
+        if i == 0 or i == len(lap_video) - 1:
+            continue
+        eulerian.magnify_level(level, freq_min, freq_max, fps, args.amplification, mode=args.temporal_filter)
 
-for frame in amplified_frames:
-    cv2.imshow("frame", frame)
-    cv2.waitKey(20)
+    # Collapse laplacian pyramid to generate final video
+    print("Rebuilding final video...")
+    amplified_frames = pyramids.collapse_laplacian_video_pyramid_parallel(lap_video)
 
+    if args.output:
+        print("Writing final video...")
+        (height, width) = amplified_frames.shape[1:3]
+        writer = cv2.VideoWriter(args.output, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+        for frame in amplified_frames:
+            writer.write(frame)
+        writer.release()
 
+    if args.show:
+        print("Displaying final video...")
+        for frame in amplified_frames:
+            cv2.imshow("frame", frame)
+            cv2.waitKey(20)
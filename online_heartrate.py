@@ -0,0 +1,114 @@
+import cv2
+import numpy as np
+
+from resample import resample_trace
+
+
+class SlidingHeartRateEstimator:
+    """
+    Online heart rate estimator for live capture.
+
+    Keeps only a ring buffer of per-frame ROI channel means and, every
+    `update_every` frames, evaluates a bank of DFT (Goertzel) bins spanning
+    freq_min..freq_max over the most recent window. The bin basis is
+    precomputed, so every update costs O(window * bins) regardless of how
+    long capture has been running.
+
+    Frames pushed with their capture timestamps are resampled onto the
+    uniform fps grid the bin basis assumes before each estimate, so jittery
+    delivery, dropped frames and frames without a face do not shift the
+    frequency, and a wrong nominal fps only changes the grid rate.
+    """
+
+    def __init__(self, fps, freq_min=1.0, freq_max=1.8, window_seconds=10.0,
+                 min_seconds=3.0, update_every=None, bpm_resolution=1.0, channel=1):
+        """
+        Args:
+            fps: Capture frame rate in Hz, the rate of the resampling grid with timestamps
+            freq_min: Minimum heart rate frequency in Hz
+            freq_max: Maximum heart rate frequency in Hz
+            window_seconds: Length of the analysis window
+            min_seconds: Signal length required before the first estimate
+            update_every: Frames between estimates, defaults to one second
+            bpm_resolution: Spacing of the frequency bins in BPM
+            channel: Channel of the ROI means to analyse (1 is green for BGR)
+        """
+        self.fps = float(fps)
+        self.window = max(2, int(round(window_seconds * self.fps)))
+        self.min_samples = max(2, int(round(min_seconds * self.fps)))
+        self.update_every = update_every or max(1, int(round(self.fps)))
+        self.channel = channel
+
+        self.frequencies = np.arange(freq_min, freq_max + 1e-9, bpm_resolution / 60.0)
+        t = np.arange(self.window) / self.fps
+        self._basis = np.exp(-2j * np.pi * np.outer(self.frequencies, t)).astype(np.complex64)
+
+        self._means = np.zeros((self.window, 3), dtype=np.float32)
+        self._times = np.full(self.window, np.nan)
+        self._index = 0
+        self._count = 0
+        self.heart_rate = None
+
+    def reset(self):
+        self._index = 0
+        self._count = 0
+        self.heart_rate = None
+
+    def push_frame(self, roi_frame, timestamp=None):
+        """
+        Add a BGR ROI frame captured at timestamp (seconds, optional).
+        Returns the new BPM estimate when one is published, else None.
+        """
+        means = cv2.mean(roi_frame)[:3]
+        return self.push_means(means, timestamp)
+
+    def push_means(self, means, timestamp=None):
+        """
+        Add one frame's per-channel ROI means captured at timestamp (seconds, optional).
+        Returns the new BPM estimate when one is published, else None.
+        """
+        self._means[self._index] = means
+        self._times[self._index] = np.nan if timestamp is None else timestamp
+        self._index = (self._index + 1) % self.window
+        self._count += 1
+
+        if self._count < self.min_samples or self._count % self.update_every != 0:
+            return None
+
+        self.heart_rate = self._estimate()
+        return self.heart_rate
+
+    def signal(self):
+        """
+        Return the buffered ROI means in chronological order as a (n, 3) array.
+        """
+        return self._ordered(self._means)
+
+    def timestamps(self):
+        """
+        Return the timestamps of the buffered means in chronological order, NaN where none was given.
+        """
+        return self._ordered(self._times)
+
+    def _ordered(self, buffer):
+        n = min(self._count, self.window)
+        if self._count <= self.window:
+            return buffer[:n]
+        return np.concatenate((buffer[self._index:], buffer[:self._index]))
+
+    def _estimate(self):
+        trace = self.signal()[:, self.channel]
+        times = self.timestamps()
+        if not np.isnan(times).any():
+            # Latest window_seconds of the trace on the uniform grid
+            trace = resample_trace(trace, times, self.fps)[0][-self.window:]
+        n = len(trace)
+        if n < 2:
+            return self.heart_rate
+
+        # Detrend and taper the window before evaluating the bin bank
+        trace = (trace - trace.mean()) * np.hanning(n)
+        power = np.abs(self._basis[:, :n] @ trace)
+
+        heart_rate_freq = self.frequencies[np.argmax(power)]
+        return round(float(heart_rate_freq) * 60, 1)
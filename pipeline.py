@@ -0,0 +1,345 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import profiling
+from eulerian import fft_filter
+from face_regions import fuse_patch_traces
+from heartrate import find_heart_rate
+from preprocessing import ROITracker, PROGRESS_INTERVAL
+from resample import resample_uniform
+from result_cache import file_digest
+from signal_methods import DEFAULT_METHOD, extract_pulse
+from signal_extraction import extract_region_traces, extract_subject_traces, extract_video_trace
+
+
+# Empty result used when no usable signal was extracted
+def _empty_result(frames=0, fps=0):
+    return {
+        'heart_rate': 0,
+        'hrv_metrics': {'sdnn': 0, 'rmssd': 0, 'valid': False},
+        'frames': frames,
+        'fps': fps,
+    }
+
+
+# Cache key parameters describing ingestion; empty for full-size, full-rate decoding
+def _ingest_params(target_size, target_fps):
+    params = {}
+    if target_size is not None:
+        params['target_size'] = [int(v) for v in target_size]
+    if target_fps is not None:
+        params['target_fps'] = float(target_fps)
+    return params
+
+
+# Cache key parameter naming a signal method, which may be a callable
+def _method_name(method):
+    return method if isinstance(method, str) else getattr(method, '__name__', repr(method))
+
+
+def analyze_trace(trace, fps, freq_min, freq_max, cache=None, source_hash=None, params=None,
+                  method=DEFAULT_METHOD):
+    """
+    Project a ROI mean trace to a pulse signal, band-pass it and estimate heart rate / HRV.
+
+    Args:
+        trace: Uniformly sampled (T, 3) ROI mean trace
+        fps: Sample rate of the trace in Hz
+        freq_min: Minimum heart rate frequency in Hz
+        freq_max: Maximum heart rate frequency in Hz
+        cache: Optional result_cache.ResultCache the spectrum and result are read from and stored in
+        source_hash: Content hash of the source video, see result_cache.file_digest
+        params: Cache key parameters of the trace and band
+        method: Pulse signal method, a name in signal_methods.SIGNAL_METHODS
+
+    Returns:
+        dict: Result of heartrate.find_heart_rate, plus the frame count and fps
+    """
+    if len(trace) < 2 or fps <= 0:
+        return _empty_result(len(trace), fps)
+
+    spectrum = None
+    if cache is not None:
+        spectrum = cache.get('spectrum', source_hash, **params)
+
+    if spectrum is None:
+        filtered_signal, frequencies = fft_filter(extract_pulse(trace, fps, method), freq_min, freq_max, fps)
+        if cache is not None:
+            cache.put('spectrum', source_hash, {'spectrum': filtered_signal, 'frequencies': frequencies}, **params)
+    else:
+        filtered_signal, frequencies = spectrum['spectrum'], spectrum['frequencies']
+
+    result = find_heart_rate(filtered_signal, frequencies, freq_min, freq_max, len(trace))
+    result['frames'] = len(trace)
+    result['fps'] = fps
+    if cache is not None:
+        cache.put('heart_rate', source_hash, result, **params)
+    return result
+
+
+def analyze_video(path, freq_min=1.0, freq_max=1.8, use_skin_mask=False, cache=None,
+                  use_face_regions=False, method=DEFAULT_METHOD, target_size=None, target_fps=None):
+    """
+    Run the headless heart rate and HRV pipeline on a video file.
+
+    The video is decoded once into a (T, 3) ROI mean trace, which is then
+    band-passed and analysed; no frames are kept in memory. With a cache,
+    the trace, spectrum and result are looked up by the file's content hash
+    and parameters first, so re-runs and band sweeps skip decoding.
+
+    Args:
+        path: Path to the video file
+        freq_min: Minimum heart rate frequency in Hz
+        freq_max: Maximum heart rate frequency in Hz
+        use_skin_mask: Average only skin-coloured ROI pixels
+        cache: Optional result_cache.ResultCache
+        use_face_regions: Average forehead and cheek patches instead of the
+            whole face box, fused by pulse SNR (use_skin_mask is ignored)
+        method: Pulse signal method, a name in signal_methods.SIGNAL_METHODS
+        target_size: (width, height) box frames are downscaled to fit when decoding
+        target_fps: Decimate to about this frame rate when decoding
+
+    Returns:
+        dict: Flat result row with heart rate, HRV metrics, the RR intervals (ms) and timings
+
+    Raises:
+        ValueError: If no face is tracked in enough frames to form a trace
+    """
+    source_hash = file_digest(path) if cache is not None else None
+    if use_face_regions:
+        trace_params = {'face_regions': True}
+    else:
+        trace_params = {'skin_mask': bool(use_skin_mask)}
+    trace_params.update(_ingest_params(target_size, target_fps))
+    band_params = dict(trace_params, freq_min=float(freq_min), freq_max=float(freq_max),
+                       method=_method_name(method))
+
+    extract_seconds = analysis_seconds = 0.0
+    result = cache.get('heart_rate', source_hash, **band_params) if cache is not None else None
+    cached = result is not None
+
+    if result is None:
+        start = time.perf_counter()
+        artifact = cache.get('trace', source_hash, **trace_params) if cache is not None else None
+        if artifact is None:
+            if use_face_regions:
+                trace, fps = extract_region_traces(path, target_size=target_size, target_fps=target_fps)
+            else:
+                trace, fps = extract_video_trace(path, use_skin_mask, target_size=target_size,
+                                                 target_fps=target_fps)
+            # Faceless or unreadable videos give an empty trace: an error, not a 0 bpm result
+            if trace.shape[1 if use_face_regions else 0] < 2:
+                raise ValueError("No face detected in the video")
+            if cache is not None:
+                cache.put('trace', source_hash, {'trace': trace, 'fps': np.array(fps)}, **trace_params)
+        else:
+            trace, fps = artifact['trace'], float(artifact['fps'])
+        extract_seconds = time.perf_counter() - start
+
+        # Patch traces are cached unfused, since their weights depend on the band
+        if use_face_regions:
+            trace, _ = fuse_patch_traces(trace, fps, freq_min, freq_max)
+
+        start = time.perf_counter()
+        result = analyze_trace(trace, fps, freq_min, freq_max, cache, source_hash, band_params, method)
+        analysis_seconds = time.perf_counter() - start
+
+    hrv_metrics = result['hrv_metrics']
+    return {
+        'video': os.path.basename(path),
+        'path': path,
+        'frames': result['frames'],
+        'fps': result['fps'],
+        'heart_rate': float(result['heart_rate']),
+        'sdnn': float(hrv_metrics['sdnn']),
+        'rmssd': float(hrv_metrics['rmssd']),
+        'hrv_valid': bool(hrv_metrics['valid']),
+        'rr_intervals': hrv_metrics.get('rr_intervals', []),
+        'cached': cached,
+        'extract_seconds': round(extract_seconds, 4),
+        'analysis_seconds': round(analysis_seconds, 4),
+    }
+
+
+# Pack per-subject traces into one array-only artifact for the cache, and back
+def _pack_subjects(subjects, fps):
+    artifact = {'fps': np.array(fps)}
+    for subject_id, subject in subjects.items():
+        artifact[f'trace_{subject_id}'] = subject['trace']
+        artifact[f'frame_index_{subject_id}'] = subject['frame_index']
+    return artifact
+
+
+def _unpack_subjects(artifact):
+    subjects = {}
+    for name in artifact:
+        if name.startswith('trace_'):
+            subject_id = int(name[len('trace_'):])
+            subjects[subject_id] = {
+                'trace': artifact[name],
+                'frame_index': artifact[f'frame_index_{subject_id}'],
+            }
+    return subjects, float(artifact['fps'])
+
+
+def analyze_video_subjects(path, freq_min=1.0, freq_max=1.8, use_skin_mask=False,
+                           min_seconds=5.0, workers=None, cache=None, method=DEFAULT_METHOD,
+                           target_size=None, target_fps=None):
+    """
+    Run the heart rate and HRV pipeline for every face in a video.
+
+    The video is decoded once while MultiROITracker follows each face, giving
+    one ROI mean trace per subject. The traces are then analysed in parallel
+    on a thread pool; the FFT and beat detection release the GIL.
+
+    Args:
+        path: Path to the video file
+        freq_min: Minimum heart rate frequency in Hz
+        freq_max: Maximum heart rate frequency in Hz
+        use_skin_mask: Average only skin-coloured ROI pixels
+        min_seconds: Subjects tracked for less time than this are skipped
+        workers: Analysis threads, defaults to one per subject up to os.cpu_count()
+        cache: Optional result_cache.ResultCache
+        method: Pulse signal method, a name in signal_methods.SIGNAL_METHODS
+        target_size: (width, height) box frames are downscaled to fit when decoding
+        target_fps: Decimate to about this frame rate when decoding
+
+    Returns:
+        list: One flat result row per subject, ordered by subject id
+    """
+    source_hash = file_digest(path) if cache is not None else None
+    trace_params = dict({'skin_mask': bool(use_skin_mask), 'subjects': True},
+                        **_ingest_params(target_size, target_fps))
+
+    start = time.perf_counter()
+    artifact = cache.get('subject_traces', source_hash, **trace_params) if cache is not None else None
+    if artifact is None:
+        subjects, fps = extract_subject_traces(path, use_skin_mask, target_size=target_size,
+                                               target_fps=target_fps)
+        if cache is not None:
+            cache.put('subject_traces', source_hash, _pack_subjects(subjects, fps), **trace_params)
+    else:
+        subjects, fps = _unpack_subjects(artifact)
+    extract_seconds = time.perf_counter() - start
+
+    min_frames = max(2, int(min_seconds * fps))
+    subjects = {subject_id: subject for subject_id, subject in sorted(subjects.items())
+                if len(subject['trace']) >= min_frames}
+    if not subjects:
+        return []
+
+    def analyze_subject(subject_id):
+        subject_start = time.perf_counter()
+        band_params = dict(trace_params, subject=subject_id, freq_min=float(freq_min),
+                           freq_max=float(freq_max), method=_method_name(method))
+        result = cache.get('heart_rate', source_hash, **band_params) if cache is not None else None
+        cached = result is not None
+        if result is None:
+            result = analyze_trace(subjects[subject_id]['trace'], fps, freq_min, freq_max,
+                                   cache, source_hash, band_params, method)
+        return result, cached, time.perf_counter() - subject_start
+
+    workers = workers or min(len(subjects), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(analyze_subject, subjects))
+
+    rows = []
+    for subject_id, (result, cached, analysis_seconds) in zip(subjects, results):
+        hrv_metrics = result['hrv_metrics']
+        frame_index = subjects[subject_id]['frame_index']
+        rows.append({
+            'video': os.path.basename(path),
+            'path': path,
+            'subject': subject_id,
+            'first_frame': int(frame_index[0]),
+            'frames': result['frames'],
+            'fps': result['fps'],
+            'heart_rate': float(result['heart_rate']),
+            'sdnn': float(hrv_metrics['sdnn']),
+            'rmssd': float(hrv_metrics['rmssd']),
+            'hrv_valid': bool(hrv_metrics['valid']),
+            'rr_intervals': hrv_metrics.get('rr_intervals', []),
+            'cached': cached,
+            'extract_seconds': round(extract_seconds, 4),
+            'analysis_seconds': round(analysis_seconds, 4),
+        })
+    return rows
+
+
+def analyze_frames(frames, fps, freq_min=1.0, freq_max=1.8, cache=None, source_hash=None,
+                   method=DEFAULT_METHOD, timestamps=None, total=None):
+    """
+    Run the heart rate and HRV pipeline on BGR frames already in memory.
+
+    With timestamps, the ROI mean trace is resampled onto a uniform grid at
+    fps before filtering, so jittery captures and frames without a face do
+    not distort the spectrum.
+
+    Args:
+        frames: Sequence of full BGR frames, or an iterator over frames still
+            being loaded (see capture.FileLoader.iter_frames)
+        fps: Frames per second of the capture
+        freq_min: Minimum heart rate frequency in Hz
+        freq_max: Maximum heart rate frequency in Hz
+        cache: Optional result_cache.ResultCache, used when source_hash is given
+        source_hash: Content hash of the file the frames were decoded from
+        method: Pulse signal method, a name in signal_methods.SIGNAL_METHODS
+        timestamps: Optional (T,) capture time of every frame in seconds;
+            only indexed up to the frame being analysed, so it may still be growing
+        total: Expected frame count for progress, when frames has no len()
+
+    Returns:
+        dict: Result of heartrate.find_heart_rate
+    """
+    if source_hash is None:
+        cache = None
+    trace_params = {'source': 'frames'}
+    band_params = dict(trace_params, freq_min=float(freq_min), freq_max=float(freq_max),
+                       method=_method_name(method))
+
+    if cache is not None:
+        result = cache.get('heart_rate', source_hash, **band_params)
+        if result is not None:
+            return result
+        artifact = cache.get('trace', source_hash, **trace_params)
+        if artifact is not None:
+            if 'fps' in artifact:
+                fps = float(artifact['fps'])
+            return analyze_trace(artifact['trace'], fps, freq_min, freq_max, cache, source_hash, band_params,
+                                 method)
+
+    tracker = ROITracker()
+    means = []
+    face_times = []
+
+    if total is None and hasattr(frames, '__len__'):
+        total = len(frames)
+    frame_ct = 0
+
+    with profiling.stage('face_detect', total=total) as record:
+        for i, frame in enumerate(frames):
+            face_rect = tracker.update(frame)
+            if face_rect is not None:
+                (x, y, w, h) = face_rect
+                means.append(cv2.mean(frame[y:y + h, x:x + w])[:3])
+                if timestamps is not None:
+                    face_times.append(timestamps[i])
+            frame_ct = i + 1
+            if frame_ct % PROGRESS_INTERVAL == 0:
+                profiling.progress('face_detect', frame_ct, total)
+
+        if record is not None:
+            record['frames'] = frame_ct
+
+    if len(means) < 2:
+        raise ValueError("No face detected in the video")
+
+    trace = np.asarray(means, dtype=np.float32) * (1.0 / 255)
+    trace, fps = resample_uniform(trace, face_times if timestamps is not None else None, fps)
+    if cache is not None:
+        cache.put('trace', source_hash, {'trace': trace, 'fps': np.array(fps)}, **trace_params)
+    return analyze_trace(trace, fps, freq_min, freq_max, cache, source_hash, band_params, method)
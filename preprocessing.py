@@ -1,38 +1,467 @@
+import os
+import time
+from functools import lru_cache
+
 import cv2
 import numpy as np
 
-faceCascade = cv2.CascadeClassifier("haarcascades/haarcascade_frontalface_alt0.xml")
+import profiling
+from ingest import VideoSource
 
+# Frames between progress reports to the active profiler
+PROGRESS_INTERVAL = 30
 
-# Read in and simultaneously preprocess video
-def read_video(path):
-    cap = cv2.VideoCapture(path)
-    fps = int(cap.get(cv2.CAP_PROP_FPS))
-    video_frames = []
-    face_rects = ()
+# Bundled Haar cascades, resolved relative to this file rather than the working directory
+CASCADE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "haarcascades")
+DEFAULT_CASCADE = "haarcascade_frontalface_alt0"
 
-    while cap.isOpened():
-        ret, img = cap.read()
-        if not ret:
-            break
-        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-        roi_frame = img
 
-        # Detect face
-        if len(video_frames) == 0:
-            face_rects = faceCascade.detectMultiScale(gray, 1.3, 5)
+# Load a bundled Haar cascade by name, once per process
+@lru_cache(maxsize=None)
+def load_cascade(name=DEFAULT_CASCADE):
+    filename = name if name.endswith(".xml") else name + ".xml"
+    cascade = cv2.CascadeClassifier(os.path.join(CASCADE_DIR, filename))
+    if cascade.empty():
+        raise FileNotFoundError(f"Could not load Haar cascade: {filename}")
+    return cascade
+
+
+# Keep the old module-level faceCascade name working without loading it at import
+def __getattr__(name):
+    if name == "faceCascade":
+        return load_cascade()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Size face ROIs are resized to for magnification, which needs fixed-size frames
+ROI_SIZE = (500, 500)
+
+
+# Detect all faces in a grayscale frame on a downscaled copy, in full-frame coordinates
+def detect_faces(gray, detect_scale=0.5, cascade=DEFAULT_CASCADE):
+    small = cv2.resize(gray, None, fx=detect_scale, fy=detect_scale, interpolation=cv2.INTER_AREA)
+    face_rects = load_cascade(cascade).detectMultiScale(small, 1.3, 5)
+    return [tuple(int(round(v / detect_scale)) for v in rect) for rect in face_rects]
+
+
+# Intersection over union of two (x, y, w, h) boxes
+def _iou(a, b):
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    inter = max(0, x1 - x0) * max(0, y1 - y0)
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union else 0.0
+
+
+class ROITracker:
+    """
+    Face ROI tracker that amortizes Haar detection across frames.
+
+    The cascade runs on a downscaled frame every `detect_every` frames, or
+    sooner when the tracker loses confidence. In between, the box is moved
+    by normalized template matching of the last detected face inside a
+    small search window, which costs a fraction of a detection.
+    """
+
+    def __init__(self, detect_every=30, detect_scale=0.5, min_confidence=0.6,
+                 search_margin=0.25, track_scale=0.25, cascade=DEFAULT_CASCADE):
+        """
+        Args:
+            detect_every: Frames between forced re-detections, 0 to only re-detect when tracking fails
+            detect_scale: Downscale factor of the frame given to the cascade
+            min_confidence: Template match score below which the face is re-detected
+            search_margin: Search window padding around the box, as a fraction of its size
+            track_scale: Downscale factor of the frames used for template matching
+            cascade: Name of the detection cascade in haarcascades/
+        """
+        self.detect_every = detect_every
+        self.detect_scale = detect_scale
+        self.min_confidence = min_confidence
+        self.search_margin = search_margin
+        self.track_scale = track_scale
+        self.cascade = cascade
+
+        self.rect = None
+        self.confidence = 0.0
+        self.timings = {'detect': 0.0, 'detect_calls': 0, 'track': 0.0, 'track_calls': 0}
+        self._template = None
+        self._since_detection = 0
+
+    def reset(self):
+        self.rect = None
+        self.confidence = 0.0
+        self._template = None
+        self._since_detection = 0
+
+    def update(self, img):
+        """
+        Return the face ROI (x, y, w, h) for a BGR frame, or None if no face is found.
+        """
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+        due = self.detect_every and self._since_detection >= self.detect_every
+        if self.rect is not None:
+            self._track(gray)
+
+        if self.rect is None or due or self.confidence < self.min_confidence:
+            self._detect(gray)
+
+        self._since_detection += 1
+        return self.rect
+
+    def _detect(self, gray):
+        start = time.perf_counter()
+
+        face_rects = detect_faces(gray, self.detect_scale, self.cascade)
 
-        # Select ROI
         if len(face_rects) > 0:
-            for (x, y, w, h) in face_rects:
-                roi_frame = img[y:y + h, x:x + w]
+            self._accept(gray, face_rects[-1])
+        elif self.confidence < self.min_confidence:
+            # Keep a confidently tracked box when a scheduled detection misses
+            self.reset()
+        self._since_detection = 0
+
+        self.timings['detect'] += time.perf_counter() - start
+        self.timings['detect_calls'] += 1
+
+    def _accept(self, gray, rect):
+        # Start tracking a freshly detected box
+        (x, y, w, h) = rect
+        self.rect = (x, y, w, h)
+        self.confidence = 1.0
+        self._template = self._downscale(gray[y:y + h, x:x + w])
+        self._since_detection = 0
+
+    def _track(self, gray):
+        start = time.perf_counter()
+
+        (x, y, w, h) = self.rect
+        pad_x, pad_y = int(w * self.search_margin), int(h * self.search_margin)
+        x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+        x1, y1 = min(gray.shape[1], x + w + pad_x), min(gray.shape[0], y + h + pad_y)
+
+        search = self._downscale(gray[y0:y1, x0:x1])
+        if search.shape[0] < self._template.shape[0] or search.shape[1] < self._template.shape[1]:
+            self.confidence = 0.0
+        else:
+            scores = cv2.matchTemplate(search, self._template, cv2.TM_CCOEFF_NORMED)
+            _, self.confidence, _, (dx, dy) = cv2.minMaxLoc(scores)
+            x = min(x0 + int(round(dx / self.track_scale)), gray.shape[1] - w)
+            y = min(y0 + int(round(dy / self.track_scale)), gray.shape[0] - h)
+            self.rect = (x, y, w, h)
+
+        self.timings['track'] += time.perf_counter() - start
+        self.timings['track_calls'] += 1
+
+    def _downscale(self, gray):
+        return cv2.resize(gray, None, fx=self.track_scale, fy=self.track_scale, interpolation=cv2.INTER_AREA)
+
+
+class MultiROITracker:
+    """
+    Tracks every face in the frame, giving each subject a stable id.
+
+    One cascade pass on the downscaled frame serves all subjects. Each
+    detection is matched to an existing subject by box overlap; unmatched
+    detections become new subjects. Between detections every subject is
+    followed by its own template matcher, as in ROITracker. A subject whose
+    tracking confidence drops and is not re-detected is dropped, and a face
+    that reappears later gets a new id.
+    """
+
+    def __init__(self, detect_every=30, detect_scale=0.5, min_confidence=0.6,
+                 search_margin=0.25, track_scale=0.25, min_overlap=0.3,
+                 max_subjects=None, cascade=DEFAULT_CASCADE):
+        """
+        Args:
+            detect_every: Frames between detections looking for new or lost faces
+            detect_scale: Downscale factor of the frame given to the cascade
+            min_confidence: Template match score below which a subject is re-detected
+            search_margin: Search window padding around each box, as a fraction of its size
+            track_scale: Downscale factor of the frames used for template matching
+            min_overlap: Intersection over union for a detection to continue a subject
+            max_subjects: Most subjects tracked at once, None for no limit
+            cascade: Name of the detection cascade in haarcascades/
+        """
+        self.detect_every = detect_every
+        self.detect_scale = detect_scale
+        self.min_confidence = min_confidence
+        self.search_margin = search_margin
+        self.track_scale = track_scale
+        self.min_overlap = min_overlap
+        self.max_subjects = max_subjects
+        self.cascade = cascade
+
+        self.subjects = {}
+        self.timings = {'detect': 0.0, 'detect_calls': 0, 'track': 0.0, 'track_calls': 0}
+        self._next_id = 0
+        self._since_detection = 0
+
+    def reset(self):
+        self.subjects = {}
+        self._next_id = 0
+        self._since_detection = 0
+
+    def update(self, img):
+        """
+        Return {subject_id: (x, y, w, h)} for every face tracked in a BGR frame.
+        """
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+        start = time.perf_counter()
+        for tracker in self.subjects.values():
+            tracker._track(gray)
+        self.timings['track'] += time.perf_counter() - start
+        self.timings['track_calls'] += len(self.subjects)
+
+        due = self.detect_every and self._since_detection >= self.detect_every
+        lost = any(t.confidence < self.min_confidence for t in self.subjects.values())
+        if not self.subjects or due or lost:
+            self._detect(gray)
+
+        self._since_detection += 1
+        return {subject_id: tracker.rect for subject_id, tracker in self.subjects.items()}
+
+    def _detect(self, gray):
+        start = time.perf_counter()
+
+        face_rects = detect_faces(gray, self.detect_scale, self.cascade)
+
+        # Greedily pair detections with subjects, best overlap first
+        pairs = sorted(((_iou(tracker.rect, rect), subject_id, i)
+                        for subject_id, tracker in self.subjects.items()
+                        for i, rect in enumerate(face_rects)), reverse=True)
+        matched_subjects, matched_rects = set(), set()
+        for overlap, subject_id, i in pairs:
+            if overlap < self.min_overlap:
+                break
+            if subject_id in matched_subjects or i in matched_rects:
+                continue
+            self.subjects[subject_id]._accept(gray, face_rects[i])
+            matched_subjects.add(subject_id)
+            matched_rects.add(i)
+
+        # Subjects that were neither re-detected nor confidently tracked are gone
+        for subject_id in list(self.subjects):
+            tracker = self.subjects[subject_id]
+            if subject_id not in matched_subjects and tracker.confidence < self.min_confidence:
+                del self.subjects[subject_id]
+
+        for i, rect in enumerate(face_rects):
+            if i in matched_rects:
+                continue
+            if self.max_subjects is not None and len(self.subjects) >= self.max_subjects:
+                break
+            tracker = ROITracker(0, self.detect_scale, self.min_confidence, self.search_margin,
+                                 self.track_scale, self.cascade)
+            tracker._accept(gray, rect)
+            self.subjects[self._next_id] = tracker
+            self._next_id += 1
+
+        self._since_detection = 0
+        self.timings['detect'] += time.perf_counter() - start
+        self.timings['detect_calls'] += 1
+
+
+# Convert a uint8 ROI to the requested working dtype
+def _convert_roi(roi_frame, dtype):
+    if np.dtype(dtype) == np.uint8:
+        return roi_frame
+    frame = np.empty(roi_frame.shape, dtype=dtype)
+    np.multiply(roi_frame, 1. / 255, out=frame, casting="unsafe")
+    return frame
+
+
+# Decode frames and run the tracker on each, yielding (frame, tracker result, timestamp)
+def _iter_tracked_frames(source, tracker):
+    total = source.frame_count
+    start = time.perf_counter()
+    decode_wall = decode_cpu = detect_wall = detect_cpu = 0.0
+    frames_read = 0
+    frames = iter(source)
+
+    try:
+        while True:
+            wall, cpu = time.perf_counter(), time.process_time()
+            item = next(frames, None)
+            decode_wall += time.perf_counter() - wall
+            decode_cpu += time.process_time() - cpu
+            if item is None:
+                break
+            img, timestamp = item
+            frames_read += 1
+            if frames_read % PROGRESS_INTERVAL == 0:
+                profiling.progress('decode', frames_read, total)
+
+            # Detect or track faces
+            wall, cpu = time.perf_counter(), time.process_time()
+            tracked = tracker.update(img)
+            detect_wall += time.perf_counter() - wall
+            detect_cpu += time.process_time() - cpu
+
+            yield img, tracked, timestamp
+    finally:
+        source.release()
+        profiling.record('decode', decode_wall, decode_cpu, frames_read, start=start)
+        profiling.record('face_detect', detect_wall, detect_cpu, frames_read, start=start)
+
+
+# Decode frames and yield preprocessed face ROIs one by one, recording the timestamp of each
+def _iter_roi_frames(source, dtype, tracker, timestamps=None, roi_size=ROI_SIZE):
+    for img, face_rect, timestamp in _iter_tracked_frames(source, tracker):
+        # Select ROI
+        if face_rect is not None:
+            (x, y, w, h) = face_rect
+            roi_frame = img[y:y + h, x:x + w]
             if roi_frame.size != img.size:
-                roi_frame = cv2.resize(roi_frame, (500, 500))
-                frame = np.ndarray(shape=roi_frame.shape, dtype="float")
-                frame[:] = roi_frame * (1. / 255)
-                video_frames.append(frame)
+                if roi_size is not None:
+                    roi_frame = cv2.resize(roi_frame, roi_size)
+                if timestamps is not None:
+                    timestamps.append(timestamp)
+                yield _convert_roi(roi_frame, dtype)
+
+
+# Decode frames and yield (frame, face_rect) pairs, recording the timestamp of each
+def _iter_face_frames(source, tracker, timestamps=None):
+    for img, face_rect, timestamp in _iter_tracked_frames(source, tracker):
+        if timestamps is not None:
+            timestamps.append(timestamp)
+        yield img, face_rect
+
+
+# Decode frames and yield (frame index, {subject_id: uint8 ROI view}) per frame
+def _iter_subject_rois(source, tracker, timestamps=None):
+    for frame_index, (img, rects, timestamp) in enumerate(_iter_tracked_frames(source, tracker)):
+        if timestamps is not None:
+            timestamps.append(timestamp)
+        yield frame_index, {subject_id: img[y:y + h, x:x + w]
+                            for subject_id, (x, y, w, h) in rects.items()}
+
+
+# Group a frame iterator into fixed-size (n, H, W, 3) chunks
+def _iter_chunks(frames, chunk_size):
+    chunk = None
+    filled = 0
+
+    for frame in frames:
+        if chunk is None:
+            chunk = np.empty((chunk_size,) + frame.shape, dtype=frame.dtype)
+        chunk[filled] = frame
+        filled += 1
+        if filled == chunk_size:
+            yield chunk
+            chunk = None
+            filled = 0
+
+    if filled:
+        yield chunk[:filled]
+
+
+def stream_video(path, chunk_size=None, dtype=np.float32, tracker=None, target_size=None, target_fps=None,
+                 timestamps=None, roi_size=ROI_SIZE):
+    """
+    Open a video and lazily decode it into preprocessed face ROI frames.
+
+    Only the frames of the current chunk are held in memory, so peak memory
+    is bounded by chunk_size rather than by the length of the clip.
+
+    Args:
+        path: Path to the video file
+        chunk_size: None to yield single (H, W, 3) frames, otherwise yield
+            (n, H, W, 3) arrays of at most chunk_size frames
+        dtype: np.uint8 yields raw pixels, float dtypes are scaled to [0, 1]
+        tracker: ROITracker following the face, a default one if None;
+            its timings attribute holds detect/track costs
+        target_size: (width, height) box decoded frames are downscaled to fit, None for native size
+        target_fps: Decimate to about this frame rate, None to keep every frame
+        timestamps: Optional list, filled with the time in seconds of every
+            ROI frame as it is yielded; frames without a face are skipped,
+            so the ROI frames are not evenly spaced in general
+        roi_size: (width, height) every ROI is resized to, or None to yield
+            the ROI as it is in the decoded frame; enough for channel means,
+            and saves a resize per frame. Such uint8 ROIs are views into
+            pooled decode buffers, valid until the next frame is read, and
+            vary in size, so they cannot be chunked
+
+    Returns:
+        Tuple containing:
+        - frames: Iterator over ROI frames or chunks of ROI frames
+        - fps: Nominal frames per second after decimation (not rounded, 29.97 stays 29.97)
+    """
+    if roi_size is None and chunk_size is not None:
+        raise ValueError("ROI frames can only be chunked when resized to a fixed roi_size")
+
+    source = VideoSource(path, target_size, target_fps)
+    fps = source.fps
+
+    if tracker is None:
+        tracker = ROITracker()
+
+    frames = _iter_roi_frames(source, dtype, tracker, timestamps, roi_size)
+    if chunk_size is not None:
+        frames = _iter_chunks(frames, chunk_size)
+
+    return frames, fps
+
+
+def stream_faces(path, tracker=None, target_size=None, target_fps=None, timestamps=None):
+    """
+    Open a video and lazily decode it into full frames with their face box.
+
+    Args:
+        path: Path to the video file
+        tracker: ROITracker following the face, a default one if None
+        target_size: (width, height) box decoded frames are downscaled to fit, None for native size
+        target_fps: Decimate to about this frame rate, None to keep every frame
+        timestamps: Optional list, filled with the time in seconds of every frame as it is yielded
+
+    Returns:
+        Tuple containing:
+        - frames: Iterator over (frame, face_rect) pairs, face_rect being
+          (x, y, w, h) or None when no face is tracked; frames are pooled
+          buffers, only valid until the iterator advances
+        - fps: Nominal frames per second after decimation
+    """
+    source = VideoSource(path, target_size, target_fps)
+    fps = source.fps
+
+    if tracker is None:
+        tracker = ROITracker()
+
+    return _iter_face_frames(source, tracker, timestamps), fps
+
+
+def stream_subjects(path, tracker=None, target_size=None, target_fps=None, timestamps=None):
+    """
+    Open a video and lazily decode it, tracking every face in one pass.
+
+    Args:
+        path: Path to the video file
+        tracker: MultiROITracker following the faces, a default one if None
+        target_size: (width, height) box decoded frames are downscaled to fit, None for native size
+        target_fps: Decimate to about this frame rate, None to keep every frame
+        timestamps: Optional list, filled with the time in seconds of every
+            frame as it is yielded, so timestamps[frame_index] is its time
+
+    Returns:
+        Tuple containing:
+        - frames: Iterator over (frame_index, {subject_id: ROI}) pairs, the
+          ROIs being raw uint8 views into a pooled frame buffer, only valid
+          until the iterator advances
+        - fps: Nominal frames per second after decimation
+    """
+    source = VideoSource(path, target_size, target_fps)
+    fps = source.fps
+
+    if tracker is None:
+        tracker = MultiROITracker()
+
+    return _iter_subject_rois(source, tracker, timestamps), fps
+
 
+# Read in and simultaneously preprocess video into frames of the working dtype
+def read_video(path, tracker=None, dtype=np.float32):
+    frames, fps = stream_video(path, dtype=dtype, tracker=tracker)
+    video_frames = list(frames)
     frame_ct = len(video_frames)
-    cap.release()
 
     return video_frames, frame_ct, fps
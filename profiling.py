@@ -0,0 +1,304 @@
+"""
+Lightweight per-stage instrumentation for the pipeline.
+
+Pipeline modules report their stages through the module-level helpers
+(stage, record, progress), which are no-ops unless a Profiler is active:
+
+    with profiling.profile() as profiler:
+        pipeline.analyze_video(path)
+    profiler.to_chrome_trace("trace.json")
+"""
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Stages reported by the pipeline modules, in pipeline order
+PIPELINE_STAGES = ['decode', 'face_detect', 'pyramid', 'fft', 'magnify', 'heart_rate', 'hrv', 'collapse']
+
+
+class Profiler:
+    """
+    Records wall time, CPU time, frames processed and bytes allocated per stage.
+
+    CPU time is process-wide (time.process_time, as in benchmark.py), so it
+    includes threads a stage fans out to, and also any other stage running
+    concurrently on another thread.
+
+    Listeners registered with add_listener are called as
+    listener(event, record) with event one of 'start', 'progress' or 'end',
+    from whichever thread runs the stage.
+    """
+
+    def __init__(self, track_allocations=False):
+        """
+        Args:
+            track_allocations: Measure bytes allocated per stage with tracemalloc (slower)
+        """
+        self.track_allocations = track_allocations
+        self.records = []
+        self.listeners = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def _notify(self, event, record):
+        for listener in self.listeners:
+            listener(event, record)
+
+    def _new_record(self, name, frames, total):
+        return {
+            'name': name,
+            'start': time.perf_counter() - self._origin,
+            'wall': 0.0,
+            'cpu': 0.0,
+            'frames': frames,
+            'total_frames': total,
+            'bytes': 0,
+            'thread': threading.get_ident(),
+        }
+
+    @contextmanager
+    def stage(self, name, frames=0, total=None):
+        """
+        Time the enclosed block as one stage and yield its record.
+        """
+        record = self._new_record(name, frames, total)
+        merged = getattr(self._local, 'merged', None)
+        if merged is None or name not in merged:
+            self._notify('start', record)
+
+        if self.track_allocations:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            # reset_peak() drops the enclosing stage's peak so far, so carry it on this thread's stack
+            peaks = self._local.__dict__.setdefault('peaks', [])
+            if peaks:
+                peaks[-1] = max(peaks[-1], tracemalloc.get_traced_memory()[1])
+            peaks.append(0)
+            tracemalloc.reset_peak()
+            start_bytes = tracemalloc.get_traced_memory()[0]
+
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall'] = time.perf_counter() - wall
+            record['cpu'] = time.process_time() - cpu
+            if self.track_allocations:
+                peak = max(tracemalloc.get_traced_memory()[1], peaks.pop())
+                if peaks:
+                    peaks[-1] = max(peaks[-1], peak)
+                record['bytes'] = max(0, peak - start_bytes)
+
+            if merged is not None:
+                self._merge(merged, record)
+            else:
+                with self._lock:
+                    self.records.append(record)
+                self._notify('end', record)
+
+    # Fold a stage record into the merged record of the same name
+    @staticmethod
+    def _merge(merged, record):
+        total = merged.get(record['name'])
+        if total is None:
+            merged[record['name']] = record
+            return
+        total['wall'] += record['wall']
+        total['cpu'] += record['cpu']
+        total['frames'] += record['frames']
+        total['bytes'] = max(total['bytes'], record['bytes'])
+
+    @contextmanager
+    def merging(self, merged):
+        """
+        Fold the stages this thread runs in the enclosed block into merged.
+
+        merged maps a stage name to one record whose wall/cpu time and
+        frames are summed over every run of that stage (bytes is the
+        largest run). Loops that run stages per frame, like streaming
+        magnification, wrap each iteration in this and call add_records
+        once at the end, so records do not grow with the length of the clip.
+        """
+        previous = getattr(self._local, 'merged', None)
+        self._local.merged = merged
+        try:
+            yield merged
+        finally:
+            self._local.merged = previous
+
+    def add_records(self, records):
+        """
+        Add finished stage records, e.g. the merged records of merging().
+        """
+        records = list(records)
+        with self._lock:
+            self.records.extend(records)
+        for record in records:
+            self._notify('end', record)
+
+    def record(self, name, wall, cpu=0.0, frames=0, nbytes=0, start=None):
+        """
+        Add a stage measured elsewhere, e.g. time accumulated over a decode loop.
+        """
+        record = self._new_record(name, frames, None)
+        record.update(wall=wall, cpu=cpu, bytes=nbytes)
+        if start is not None:
+            record['start'] = start - self._origin
+
+        with self._lock:
+            self.records.append(record)
+        self._notify('end', record)
+        return record
+
+    def progress(self, name, frames, total=None):
+        """
+        Report intermediate progress of a running stage to the listeners.
+        """
+        record = self._new_record(name, frames, total)
+        self._notify('progress', record)
+
+    def summary(self):
+        """
+        Return per-stage totals as {name: {'calls', 'wall', 'cpu', 'frames', 'bytes'}}.
+        """
+        totals = {}
+        with self._lock:
+            records = list(self.records)
+
+        for record in records:
+            total = totals.setdefault(record['name'],
+                                      {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'frames': 0, 'bytes': 0})
+            total['calls'] += 1
+            total['wall'] += record['wall']
+            total['cpu'] += record['cpu']
+            total['frames'] += record['frames']
+            total['bytes'] += record['bytes']
+
+        return totals
+
+    def to_json(self, path=None):
+        """
+        Return the stage records and summary as JSON, optionally writing them to path.
+        """
+        with self._lock:
+            records = list(self.records)
+        text = json.dumps({'records': records, 'summary': self.summary()}, indent=2)
+
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def to_chrome_trace(self, path=None):
+        """
+        Return the stage records in Chrome trace format (chrome://tracing, Perfetto).
+        """
+        pid = os.getpid()
+        with self._lock:
+            records = list(self.records)
+
+        events = [{
+            'name': record['name'],
+            'cat': 'pipeline',
+            'ph': 'X',
+            'ts': record['start'] * 1e6,
+            'dur': record['wall'] * 1e6,
+            'pid': pid,
+            'tid': record['thread'],
+            'args': {'cpu_ms': record['cpu'] * 1e3, 'frames': record['frames'], 'bytes': record['bytes']},
+        } for record in records]
+        text = json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'})
+
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+
+# Process-wide active profiler, None when instrumentation is off
+_active = None
+
+
+def get_profiler():
+    return _active
+
+
+@contextmanager
+def profile(profiler=None):
+    """
+    Activate a profiler (a new one if None) for the enclosed block and yield it.
+    """
+    global _active
+    previous = _active
+    _active = profiler if profiler is not None else Profiler()
+    try:
+        yield _active
+    finally:
+        _active = previous
+
+
+@contextmanager
+def stage(name, frames=0, total=None):
+    """
+    Time a stage on the active profiler; yields its record, or None when profiling is off.
+    """
+    profiler = _active
+    if profiler is None:
+        yield None
+        return
+    with profiler.stage(name, frames, total) as record:
+        yield record
+
+
+@contextmanager
+def merged_stages(merged):
+    """
+    Fold stages run by this thread in the block into merged, see Profiler.merging; no-op when profiling is off.
+    """
+    profiler = _active
+    if profiler is None:
+        yield merged
+        return
+    with profiler.merging(merged):
+        yield merged
+
+
+def add_merged(merged):
+    """
+    Add the records collected by merged_stages to the active profiler and clear them.
+    """
+    if _active is not None and merged:
+        _active.add_records(merged.values())
+    merged.clear()
+
+
+def profiled(name):
+    """
+    Decorator running the whole function as one stage of the active profiler.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(name, wall, cpu=0.0, frames=0, nbytes=0, start=None):
+    if _active is not None:
+        _active.record(name, wall, cpu, frames, nbytes, start)
+
+
+def progress(name, frames, total=None):
+    if _active is not None:
+        _active.progress(name, frames, total)
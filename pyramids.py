@@ -1,11 +1,16 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
 
+import profiling
+
 
-# Build Gaussian image pyramid
-def build_gaussian_pyramid(img, levels):
-    float_img = np.ndarray(shape=img.shape, dtype="float")
-    float_img[:] = img
+# Build Gaussian image pyramid in the working dtype
+def build_gaussian_pyramid(img, levels, dtype=np.float32):
+    float_img = np.empty(img.shape, dtype=dtype)
+    np.copyto(float_img, img, casting="unsafe")
     pyramid = [float_img]
 
     for i in range(levels-1):
@@ -16,8 +21,8 @@ def build_gaussian_pyramid(img, levels):
 
 
 # Build Laplacian image pyramid from Gaussian pyramid
-def build_laplacian_pyramid(img, levels):
-    gaussian_pyramid = build_gaussian_pyramid(img, levels)
+def build_laplacian_pyramid(img, levels, dtype=np.float32):
+    gaussian_pyramid = build_gaussian_pyramid(img, levels, dtype)
     laplacian_pyramid = []
 
     for i in range(levels-1):
@@ -32,16 +37,89 @@ def build_laplacian_pyramid(img, levels):
     return laplacian_pyramid
 
 
+def build_laplacian_video_pyramid(video, levels=3, dtype=np.float32, out=None):
+    """
+    Build the Laplacian pyramid of a whole video in one batched pass.
+
+    Every level is preallocated as a (T, h, w, C) buffer up front. Gaussian
+    levels are written straight into those buffers and turned into Laplacian
+    levels in place, so no memory is allocated per frame.
+
+    Args:
+        video: Array of shape (T, H, W, C)
+        levels: Number of pyramid levels
+        dtype: Working dtype of the pyramid levels; float32 halves memory
+            traffic against float64 at well under one grey level of error
+            after collapse (see benchmark.check_precision)
+        out: Optional list of level buffers from a previous call with the
+            same video shape, reused instead of allocating new ones (e.g.
+            one (1, h, w, C) pyramid per frame when streaming)
+
+    Returns:
+        List of `levels` arrays of shape (T, h, w, C), finest level first
+    """
+    frame_ct, height, width, depth = video.shape
+
+    level_shapes = [(height, width)]
+    for i in range(levels - 1):
+        (h, w) = level_shapes[-1]
+        level_shapes.append(((h + 1) // 2, (w + 1) // 2))
+
+    if out is None:
+        out = [np.empty((frame_ct, h, w, depth), dtype=dtype) for (h, w) in level_shapes]
+    else:
+        dtype = out[0].dtype
+    lap_video = out
+    upsampled = [np.empty((h, w, depth), dtype=dtype) for (h, w) in level_shapes[:-1]]
+
+    with profiling.stage('pyramid', frame_ct):
+        # Convert the whole clip to the working dtype in a single vectorized copy
+        np.copyto(lap_video[0], video, casting="unsafe")
+
+        for t in range(frame_ct):
+            # Gaussian levels, written directly into the level buffers
+            for i in range(levels - 1):
+                cv2.pyrDown(lap_video[i][t], dst=lap_video[i + 1][t])
+
+            # Laplacian levels, finest first so each coarser Gaussian is still intact
+            for i in range(levels - 1):
+                (h, w) = level_shapes[i]
+                cv2.pyrUp(lap_video[i + 1][t], dst=upsampled[i], dstsize=(w, h))
+                cv2.subtract(lap_video[i][t], upsampled[i], dst=lap_video[i][t])
+
+    return lap_video
+
+
 # Build video pyramid by building Laplacian pyramid for each frame
-def build_video_pyramid(frames):
+def build_video_pyramid(frames, frame_ct=None, levels=3, dtype=np.float32):
+    # A (T, H, W, C) array goes through the batched engine in one pass
+    if isinstance(frames, np.ndarray) and frames.ndim == 4:
+        return build_laplacian_video_pyramid(frames, levels, dtype)
+
+    # Frames may be a list or a lazy iterator (see preprocessing.stream_video);
+    # frame_ct lets an iterator fill preallocated levels without a list copy
+    if frame_ct is None:
+        frames = list(frames)
+        frame_ct = len(frames)
+
     lap_video = []
+    decoded = 0
+
+    with profiling.stage('pyramid', total=frame_ct) as record:
+        for i, frame in enumerate(frames):
+            pyramid = build_laplacian_pyramid(frame, levels, dtype)
+            for j in range(levels):
+                if i == 0:
+                    lap_video.append(np.empty((frame_ct, pyramid[j].shape[0], pyramid[j].shape[1], 3), dtype=dtype))
+                lap_video[j][i] = pyramid[j]
+            decoded += 1
+
+        if record is not None:
+            record['frames'] = decoded
 
-    for i, frame in enumerate(frames):
-        pyramid = build_laplacian_pyramid(frame, 3)
-        for j in range(3):
-            if i == 0:
-                lap_video.append(np.zeros((len(frames), pyramid[j].shape[0], pyramid[j].shape[1], 3)))
-            lap_video[j][i] = pyramid[j]
+    # Drop unused slots if the iterator ended early
+    if decoded < frame_ct:
+        lap_video = [level[:decoded] for level in lap_video]
 
     return lap_video
 
@@ -50,24 +128,83 @@ def build_video_pyramid(frames):
 def collapse_laplacian_video_pyramid(video, frame_ct):
     collapsed_video = []
 
-    for i in range(frame_ct):
-        prev_frame = video[-1][i]
+    with profiling.stage('collapse', frame_ct):
+        for i in range(frame_ct):
+            prev_frame = video[-1][i]
 
-        for level in range(len(video) - 1, 0, -1):
-            pyr_up_frame = cv2.pyrUp(prev_frame)
-            (height, width, depth) = pyr_up_frame.shape
-            prev_level_frame = video[level - 1][i]
-            prev_level_frame = cv2.resize(prev_level_frame, (height, width))
-            prev_frame = pyr_up_frame + prev_level_frame
-
-        # Normalize pixel values
-        min_val = min(0.0, prev_frame.min())
-        prev_frame = prev_frame + min_val
-        max_val = max(1.0, prev_frame.max())
-        prev_frame = prev_frame / max_val
-        prev_frame = prev_frame * 255
-
-        prev_frame = cv2.convertScaleAbs(prev_frame)
-        collapsed_video.append(prev_frame)
+            for level in range(len(video) - 1, 0, -1):
+                pyr_up_frame = cv2.pyrUp(prev_frame)
+                (height, width, depth) = pyr_up_frame.shape
+                prev_level_frame = video[level - 1][i]
+                prev_level_frame = cv2.resize(prev_level_frame, (height, width))
+                prev_frame = pyr_up_frame + prev_level_frame
+
+            # Normalize pixel values
+            min_val = min(0.0, prev_frame.min())
+            prev_frame = prev_frame + min_val
+            max_val = max(1.0, prev_frame.max())
+            prev_frame = prev_frame / max_val
+            prev_frame = prev_frame * 255
+
+            prev_frame = cv2.convertScaleAbs(prev_frame)
+            collapsed_video.append(prev_frame)
 
     return collapsed_video
+
+
+# Collapse frames [start, stop) of a video pyramid into out with per-thread scratch buffers
+def _collapse_frame_range(video, out, start, stop):
+    scratch = [np.empty(level.shape[1:], dtype=level.dtype) for level in video[:-1]]
+
+    for i in range(start, stop):
+        prev_frame = video[-1][i]
+
+        for level in range(len(video) - 1, 0, -1):
+            (height, width, depth) = scratch[level - 1].shape
+            cv2.pyrUp(prev_frame, dst=scratch[level - 1], dstsize=(width, height))
+            cv2.add(scratch[level - 1], video[level - 1][i], dst=scratch[level - 1])
+            prev_frame = scratch[level - 1]
+
+        # Fused normalization: same result as shifting by min_val, dividing by
+        # max_val and scaling to 255, but done in a single convertScaleAbs pass
+        min_val = min(0.0, float(prev_frame.min()))
+        max_val = max(1.0, float(prev_frame.max()) + min_val)
+        scale = 255.0 / max_val
+        cv2.convertScaleAbs(prev_frame, dst=out[i], alpha=scale, beta=min_val * scale)
+
+
+def collapse_laplacian_video_pyramid_parallel(video, out=None, workers=None):
+    """
+    Collapse a video pyramid into a preallocated uint8 video using a thread pool.
+
+    OpenCV releases the GIL, so contiguous ranges of frames are collapsed
+    concurrently, each worker reusing its own scratch buffers. Output matches
+    collapse_laplacian_video_pyramid up to rounding for even-sized levels.
+
+    Args:
+        video: List of pyramid levels of shape (T, h, w, 3), finest first
+        out: Optional preallocated uint8 array of shape (T, H, W, 3)
+        workers: Number of threads, defaults to os.cpu_count()
+
+    Returns:
+        uint8 array of shape (T, H, W, 3)
+    """
+    frame_ct = video[0].shape[0]
+    if out is None:
+        out = np.empty(video[0].shape, dtype=np.uint8)
+
+    workers = min(workers or os.cpu_count() or 1, max(frame_ct, 1))
+    bounds = np.linspace(0, frame_ct, workers + 1).astype(int)
+
+    with profiling.stage('collapse', frame_ct):
+        if workers == 1:
+            _collapse_frame_range(video, out, 0, frame_ct)
+            return out
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_collapse_frame_range, video, out, start, stop)
+                       for start, stop in zip(bounds[:-1], bounds[1:])]
+            for future in futures:
+                future.result()
+
+    return out
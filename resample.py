@@ -0,0 +1,106 @@
+"""
+Put traces sampled at irregular times onto a uniform time grid.
+
+Everything spectral downstream (fft_filter, the pulse methods, beat
+detection) assumes one sample every 1 / fps seconds. That does not hold for
+webcam captures, whose rate follows the camera and system load, for
+variable frame rate files, or when frames without a tracked face are
+dropped from a trace. Each sample therefore carries the timestamp of its
+frame, and the trace is linearly interpolated onto a uniform grid before
+filtering. Traces that are already uniform are returned untouched.
+"""
+import numpy as np
+
+# Intervals within this fraction of the nominal period count as uniform sampling
+UNIFORM_TOLERANCE = 0.05
+
+
+def estimate_fps(timestamps):
+    """Sample rate from the median interval between timestamps, robust to gaps and dropped frames."""
+    intervals = np.diff(np.asarray(timestamps, dtype=np.float64))
+    intervals = intervals[intervals > 0]
+    if len(intervals) == 0:
+        return 0.0
+    return 1.0 / float(np.median(intervals))
+
+
+def is_uniform(timestamps, fps, tolerance=UNIFORM_TOLERANCE):
+    """Whether every interval between timestamps is within tolerance of 1 / fps."""
+    if len(timestamps) < 2:
+        return True
+    intervals = np.diff(np.asarray(timestamps, dtype=np.float64)) * fps
+    return bool(np.all(np.abs(intervals - 1.0) <= tolerance))
+
+
+def resample_trace(trace, timestamps, fps, axis=0):
+    """
+    Linearly interpolate a trace onto a uniform grid.
+
+    All channels are interpolated at once: every grid point is located with
+    one searchsorted over the timestamps and blended from its two
+    neighbouring samples.
+
+    Args:
+        trace: Array with one sample per timestamp along axis, e.g. a (T, 3) channel mean trace
+        timestamps: (T,) sample times in seconds, strictly increasing
+        fps: Rate of the output grid in Hz
+        axis: Time axis of trace
+
+    Returns:
+        Tuple containing:
+        - resampled: trace with time axis resampled to the grid, same dtype as trace
+        - grid: Sample times of the grid, starting at timestamps[0]
+    """
+    trace = np.asarray(trace)
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if len(timestamps) < 2:
+        return trace, timestamps
+
+    count = int(np.floor((timestamps[-1] - timestamps[0]) * fps + 1e-6)) + 1
+    grid = timestamps[0] + np.arange(count) / fps
+
+    # Left neighbour of every grid point, and its weight against the right one
+    left = np.clip(np.searchsorted(timestamps, grid, side='right') - 1, 0, len(timestamps) - 2)
+    weight = (grid - timestamps[left]) / (timestamps[left + 1] - timestamps[left])
+
+    samples = np.moveaxis(trace, axis, 0)
+    weight = weight.reshape((-1,) + (1,) * (samples.ndim - 1))
+    resampled = samples[left] * (1 - weight) + samples[left + 1] * weight
+
+    return np.moveaxis(resampled.astype(trace.dtype, copy=False), 0, axis), grid
+
+
+def resample_uniform(trace, timestamps, fps=None, axis=0):
+    """
+    Return a trace sampled uniformly at fps, resampling it only if needed.
+
+    Args:
+        trace: Array with one sample per timestamp along axis
+        timestamps: (T,) sample times in seconds, None if the trace is known to be uniform
+        fps: Output rate, estimated from the timestamps if None
+        axis: Time axis of trace
+
+    Returns:
+        Tuple containing:
+        - trace: Uniformly sampled trace
+        - fps: Its sample rate
+    """
+    if timestamps is None or len(timestamps) < 2:
+        return trace, fps
+
+    # Drop samples whose timestamp is missing or does not advance (stalled or reset clocks)
+    timestamps = np.nan_to_num(np.asarray(timestamps, dtype=np.float64), nan=-np.inf)
+    keep = np.concatenate(([True], timestamps[1:] > np.maximum.accumulate(timestamps)[:-1]))
+    keep &= np.isfinite(timestamps)
+    if not keep.all():
+        trace = np.compress(keep, trace, axis=axis)
+        timestamps = timestamps[keep]
+        if len(timestamps) < 2:
+            return trace, fps
+
+    if not fps:
+        fps = estimate_fps(timestamps)
+    if is_uniform(timestamps, fps):
+        return trace, fps
+
+    return resample_trace(trace, timestamps, fps, axis)[0], fps
@@ -0,0 +1,164 @@
+"""
+Persistent content-addressed cache of analysis artifacts.
+
+Artifacts (ROI mean traces, filtered spectra, heart rate / HRV results) are
+keyed by a hash of the source video's bytes plus the parameters that
+produced them. Re-running a recording with the same settings, or sweeping
+only the frequency band, then skips decoding entirely. The cache directory
+is kept under max_bytes by evicting the least recently used entries.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "hrv-analysis")
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+# Hashed into every key; bump whenever the code producing a cached artifact
+# (traces, spectra, heart rate results) changes, so stale entries become misses
+CACHE_VERSION = 4
+
+# Digests are memoized per (path, size, mtime) so unchanged files are hashed once per process
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Return the SHA-256 hex digest of a file's contents."""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digests_lock:
+        if memo_key in _digests:
+            return _digests[memo_key]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+
+    with _digests_lock:
+        _digests[memo_key] = digest.hexdigest()
+    return _digests[memo_key]
+
+
+class ResultCache:
+    """
+    Directory of cached artifacts with LRU eviction by total size.
+
+    Artifacts made only of arrays are stored as .npz, anything else as .json.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Args:
+            directory: Cache directory, defaults to $HRV_CACHE_DIR or ~/.cache/hrv-analysis
+            max_bytes: Size above which least recently used entries are evicted
+        """
+        self.directory = directory or os.environ.get("HRV_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(kind, source_hash, **params):
+        """Hash the cache version, artifact kind, source digest and parameters into a cache key."""
+        payload = json.dumps([CACHE_VERSION, kind, source_hash, params], sort_keys=True, default=float)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key, ext):
+        return os.path.join(self.directory, key + ext)
+
+    def get(self, kind, source_hash, **params):
+        """
+        Return the cached artifact, or None on a miss.
+        """
+        key = self.key(kind, source_hash, **params)
+
+        for ext in ('.npz', '.json'):
+            path = self._path(key, ext)
+            try:
+                if ext == '.npz':
+                    with np.load(path, allow_pickle=False) as data:
+                        value = {name: data[name] for name in data.files}
+                else:
+                    with open(path) as f:
+                        value = json.load(f)
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError):
+                # Truncated or corrupt entry; drop it and treat as a miss
+                self._remove(path)
+                continue
+
+            # Touch the entry so eviction sees it as recently used
+            os.utime(path)
+            return value
+
+        return None
+
+    def put(self, kind, source_hash, value, **params):
+        """
+        Store an artifact (a dict of arrays, or a JSON-serializable dict).
+        """
+        key = self.key(kind, source_hash, **params)
+        is_arrays = all(isinstance(v, np.ndarray) for v in value.values())
+        path = self._path(key, '.npz' if is_arrays else '.json')
+
+        # Write to a temp file and rename, so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb' if is_arrays else 'w') as f:
+                if is_arrays:
+                    np.savez(f, **value)
+                else:
+                    json.dump(value, f, default=_to_json)
+            os.replace(tmp_path, path)
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in max_bytes.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(('.npz', '.json')):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(('.npz', '.json', '.tmp')):
+                self._remove(os.path.join(self.directory, name))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# JSON fallback for NumPy scalars inside result dicts
+def _to_json(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
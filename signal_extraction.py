@@ -0,0 +1,182 @@
+import cv2
+import numpy as np
+from typing import Dict, Iterable, Optional, Tuple
+
+from face_regions import PATCH_NAMES, PatchTracker
+from preprocessing import ROI_SIZE, MultiROITracker, ROITracker, stream_faces, stream_subjects, stream_video
+from resample import resample_uniform
+
+# YCrCb bounds of the skin mask
+SKIN_YCRCB_LOWER = (0, 133, 77)
+SKIN_YCRCB_UPPER = (255, 173, 127)
+
+# BGR weights matching cv2.COLOR_BGR2GRAY
+LUMINANCE_WEIGHTS = np.array([0.114, 0.587, 0.299], dtype=np.float32)
+
+
+def skin_mask(frame: np.ndarray) -> np.ndarray:
+    """Return a uint8 mask of skin-coloured pixels in a BGR frame."""
+    if frame.dtype != np.uint8:
+        frame = cv2.convertScaleAbs(frame, alpha=255.0)
+    ycrcb = cv2.cvtColor(frame, cv2.COLOR_BGR2YCrCb)
+    return cv2.inRange(ycrcb, SKIN_YCRCB_LOWER, SKIN_YCRCB_UPPER)
+
+
+def _iter_frames(frames: Iterable[np.ndarray]) -> Iterable[np.ndarray]:
+    # Accept single frames as well as (n, H, W, 3) chunks from stream_video
+    for item in frames:
+        if item.ndim == 4:
+            yield from item
+        else:
+            yield item
+
+
+def extract_channel_means(frames: Iterable[np.ndarray],
+                          use_skin_mask: bool = False) -> np.ndarray:
+    """
+    Reduce ROI frames to a per-frame, per-channel spatial mean trace.
+
+    Frames are consumed one at a time straight from the decoder (uint8 or
+    float, list, array or iterator of frames or chunks), so memory is O(T)
+    instead of O(T*H*W).
+
+    Args:
+        frames: ROI frames in BGR order
+        use_skin_mask: Average only skin-coloured pixels of each frame
+
+    Returns:
+        float32 array of shape (T, 3) with channel means scaled to [0, 1]
+    """
+    if isinstance(frames, np.ndarray) and frames.ndim == 4:
+        means = np.empty((len(frames), 3), dtype=np.float32)
+    else:
+        means = []
+
+    scale = None
+    for i, frame in enumerate(_iter_frames(frames)):
+        if scale is None:
+            scale = 1.0 / 255.0 if frame.dtype == np.uint8 else 1.0
+
+        mask = skin_mask(frame) if use_skin_mask else None
+        channel_means = cv2.mean(frame, mask=mask)[:3]
+
+        if isinstance(means, list):
+            means.append(channel_means)
+        else:
+            means[i] = channel_means
+
+    means = np.asarray(means, dtype=np.float32).reshape(-1, 3)
+    if scale is not None and scale != 1.0:
+        means *= scale
+
+    return means
+
+
+def to_luminance(trace: np.ndarray) -> np.ndarray:
+    """Collapse a (T, 3) BGR mean trace to the (T,) grayscale trace."""
+    return trace @ LUMINANCE_WEIGHTS
+
+
+def extract_video_trace(path: str,
+                        use_skin_mask: bool = False,
+                        chunk_size: Optional[int] = None,
+                        target_size: Optional[Tuple[int, int]] = None,
+                        target_fps: Optional[float] = None) -> Tuple[np.ndarray, float]:
+    """
+    Decode a video once and return its (T, 3) ROI mean trace and fps.
+
+    target_size and target_fps downscale and decimate at ingestion, see ingest.VideoSource.
+    Without chunk_size, each ROI is averaged where it lies in the decoded
+    frame instead of being resized first. The trace is resampled onto a uniform grid at fps when frame timestamps
+    are irregular or frames without a face were skipped.
+    """
+    timestamps: list = []
+    roi_size = None if chunk_size is None else ROI_SIZE
+    frames, fps = stream_video(path, chunk_size=chunk_size, dtype=np.uint8, target_size=target_size,
+                               target_fps=target_fps, timestamps=timestamps, roi_size=roi_size)
+    return resample_uniform(extract_channel_means(frames, use_skin_mask), timestamps, fps)
+
+
+def extract_region_traces(path: str,
+                          tracker: Optional[ROITracker] = None,
+                          target_size: Optional[Tuple[int, int]] = None,
+                          target_fps: Optional[float] = None) -> Tuple[np.ndarray, float]:
+    """
+    Decode a video once and return mean traces of the forehead and cheek patches.
+
+    Frames without a tracked face are skipped and the traces resampled to a
+    uniform grid, as in extract_video_trace.
+
+    Args:
+        path: Path to the video file
+        tracker: ROITracker following the face, a default one if None
+        target_size: (width, height) box frames are downscaled to fit at ingestion
+        target_fps: Decimate to about this frame rate at ingestion
+
+    Returns:
+        Tuple containing:
+        - traces: float32 array of shape (P, T, 3), patches in
+          face_regions.PATCH_NAMES order, scaled to [0, 1]
+        - fps: Frames per second of the source video
+    """
+    timestamps: list = []
+    frames, fps = stream_faces(path, tracker, target_size, target_fps, timestamps)
+    patch_tracker = PatchTracker()
+    means = []
+    face_times = []
+    for img, face_rect in frames:
+        if face_rect is not None:
+            means.append(patch_tracker.update(img, face_rect))
+            face_times.append(timestamps[-1])
+
+    traces = np.asarray(means, dtype=np.float32).reshape(-1, len(PATCH_NAMES), 3)
+    return resample_uniform(traces.transpose(1, 0, 2) * np.float32(1.0 / 255), face_times, fps, axis=1)
+
+
+def extract_subject_traces(path: str,
+                           use_skin_mask: bool = False,
+                           min_frames: int = 2,
+                           tracker: Optional[MultiROITracker] = None,
+                           target_size: Optional[Tuple[int, int]] = None,
+                           target_fps: Optional[float] = None
+                           ) -> Tuple[Dict[int, Dict[str, np.ndarray]], float]:
+    """
+    Decode a video once and return a mean trace for every tracked face.
+
+    Args:
+        path: Path to the video file
+        use_skin_mask: Average only skin-coloured pixels of each ROI
+        min_frames: Subjects seen in fewer frames are dropped
+        tracker: MultiROITracker following the faces, a default one if None
+        target_size: (width, height) box frames are downscaled to fit at ingestion
+        target_fps: Decimate to about this frame rate at ingestion
+
+    Returns:
+        Tuple containing:
+        - subjects: {subject_id: {'trace': (T, 3) float32 means in [0, 1],
+          uniformly resampled from the subject's first frame on,
+          'frame_index': indices of the frames the subject was seen in}}
+        - fps: Frames per second of the source video
+    """
+    timestamps: list = []
+    frames, fps = stream_subjects(path, tracker, target_size, target_fps, timestamps)
+    means: Dict[int, list] = {}
+    indices: Dict[int, list] = {}
+
+    for frame_index, rois in frames:
+        for subject_id, roi in rois.items():
+            mask = skin_mask(roi) if use_skin_mask else None
+            means.setdefault(subject_id, []).append(cv2.mean(roi, mask=mask)[:3])
+            indices.setdefault(subject_id, []).append(frame_index)
+
+    subjects = {}
+    for subject_id, subject_means in means.items():
+        if len(subject_means) < min_frames:
+            continue
+        frame_index = np.asarray(indices[subject_id], dtype=np.int64)
+        trace = np.asarray(subject_means, dtype=np.float32) * np.float32(1.0 / 255)
+        subjects[subject_id] = {
+            'trace': resample_uniform(trace, np.asarray(timestamps)[frame_index], fps)[0],
+            'frame_index': frame_index,
+        }
+    return subjects, fps
@@ -0,0 +1,170 @@
+"""
+Pulse signal methods: project a (T, 3) BGR channel mean trace to a (T,) pulse signal.
+
+These sit in front of eulerian.fft_filter, which band-passes whatever
+signal it is given. Heart rate only needs this 1-D signal, so none of them
+touch pixels; the Laplacian pyramid and magnification are only needed to
+render an amplified video.
+
+    luminance  grayscale mean, the original behaviour
+    green      green channel mean
+    chrom      chrominance projection (de Haan & Jeanne, 2013)
+    pos        plane-orthogonal-to-skin projection (Wang et al., 2017)
+
+CHROM and POS are computed over short overlapping windows, all windows at
+once as strided views of the trace, then overlap-added back into one signal.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from signal_extraction import to_luminance
+
+# Default projection window, about one pulse period at the lowest heart rates
+WINDOW_SECONDS = 1.6
+
+# POS projection of temporally normalized (R, G, B) onto the plane orthogonal to skin tone
+POS_PROJECTION = np.array([[0, 1, -1], [-2, 1, 1]], dtype=np.float64)
+
+
+# Overlapping (N, L, 3) windows of a trace and their start indices, the last one flush with the end
+def _windows(trace, length, hop):
+    windows = sliding_window_view(trace, length, axis=0).transpose(0, 2, 1)
+    starts = np.arange(0, len(trace) - length + 1, hop)
+    if starts[-1] != len(trace) - length:
+        starts = np.append(starts, len(trace) - length)
+    return windows[starts], starts
+
+
+# Overlap-add (N, L) window signals at their start indices into a (T,) signal
+def _overlap_add(segments, starts, total):
+    out = np.zeros(total)
+    # Starts are unique, so each offset is one scatter-add without collisions
+    for k in range(segments.shape[1]):
+        out[starts + k] += segments[:, k]
+    return out
+
+
+# Window length in frames, clipped to the trace
+def _window_length(trace, fps, window_seconds):
+    return int(np.clip(round(window_seconds * fps), 2, len(trace)))
+
+
+# Normalize each window's channels by their temporal mean
+def _normalized(windows):
+    means = windows.mean(axis=1, keepdims=True)
+    return windows / np.where(means > 0, means, 1.0)
+
+
+# Standard deviation ratio of two (N, L) signals, 0 where the second is flat
+def _std_ratio(a, b):
+    std_b = b.std(axis=1, keepdims=True)
+    return a.std(axis=1, keepdims=True) / np.where(std_b > 0, std_b, np.inf)
+
+
+def luminance(trace, fps=None):
+    """Grayscale mean signal, as used by fft_filter on a (T, 3) trace."""
+    return to_luminance(np.asarray(trace, dtype=np.float32))
+
+
+def green(trace, fps=None):
+    """Green channel mean signal."""
+    return np.asarray(trace)[:, 1]
+
+
+def chrom(trace, fps, window_seconds=WINDOW_SECONDS):
+    """
+    CHROM pulse signal.
+
+    In every window the channels are normalized by their mean, projected to
+    the chrominance signals X = 3R - 2G and Y = 1.5R + G - 1.5B, and combined
+    as X - (std X / std Y) Y, which cancels specular and motion components
+    common to both. Windows overlap by half and are Hann-weighted before
+    overlap-adding. The band-pass of the original method is left to
+    fft_filter, which runs next.
+
+    Args:
+        trace: (T, 3) BGR channel mean trace
+        fps: Frames per second of the trace
+        window_seconds: Projection window length in seconds
+
+    Returns:
+        (T,) pulse signal
+    """
+    trace = np.asarray(trace, dtype=np.float64)
+    if len(trace) < 2:
+        return np.zeros(len(trace))
+
+    length = _window_length(trace, fps, window_seconds)
+    windows, starts = _windows(trace, length, max(1, length // 2))
+    normalized = _normalized(windows)
+    b, g, r = normalized[..., 0], normalized[..., 1], normalized[..., 2]
+
+    x = 3 * r - 2 * g
+    y = 1.5 * r + g - 1.5 * b
+    pulse = x - _std_ratio(x, y) * y
+    pulse -= pulse.mean(axis=1, keepdims=True)
+
+    return _overlap_add(pulse * np.hanning(length), starts, len(trace))
+
+
+def pos(trace, fps, window_seconds=WINDOW_SECONDS):
+    """
+    POS pulse signal.
+
+    In every window the channels are normalized by their mean and projected
+    onto the plane orthogonal to the skin tone, giving S1 = G - B and
+    S2 = -2R + G + B; the pulse is S1 + (std S1 / std S2) S2. Windows advance
+    one frame at a time and are overlap-added, as in the original method.
+
+    Args:
+        trace: (T, 3) BGR channel mean trace
+        fps: Frames per second of the trace
+        window_seconds: Projection window length in seconds
+
+    Returns:
+        (T,) pulse signal
+    """
+    trace = np.asarray(trace, dtype=np.float64)
+    if len(trace) < 2:
+        return np.zeros(len(trace))
+
+    length = _window_length(trace, fps, window_seconds)
+    windows, starts = _windows(trace, length, 1)
+    # Reorder BGR to RGB to apply the projection as published
+    normalized = _normalized(windows)[..., ::-1]
+
+    s = normalized @ POS_PROJECTION.T
+    s1, s2 = s[..., 0], s[..., 1]
+    pulse = s1 + _std_ratio(s1, s2) * s2
+    pulse -= pulse.mean(axis=1, keepdims=True)
+
+    return _overlap_add(pulse, starts, len(trace))
+
+
+SIGNAL_METHODS = {
+    'luminance': luminance,
+    'green': green,
+    'chrom': chrom,
+    'pos': pos,
+}
+
+DEFAULT_METHOD = 'luminance'
+
+
+def extract_pulse(trace, fps, method=DEFAULT_METHOD):
+    """
+    Turn a (T, 3) BGR channel mean trace into a (T,) pulse signal.
+
+    Args:
+        trace: Channel mean trace from signal_extraction
+        fps: Frames per second of the trace
+        method: Name in SIGNAL_METHODS, or a callable taking (trace, fps)
+
+    Returns:
+        (T,) pulse signal, ready for eulerian.fft_filter
+    """
+    if not callable(method):
+        if method not in SIGNAL_METHODS:
+            raise ValueError(f"Unknown signal method: {method!r}, expected one of {sorted(SIGNAL_METHODS)}")
+        method = SIGNAL_METHODS[method]
+    return method(trace, fps)
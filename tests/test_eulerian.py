@@ -0,0 +1,61 @@
+"""
+TemporalBandpass against scipy.signal filters run over each pixel's whole history.
+"""
+import numpy as np
+import pytest
+from scipy import signal
+
+from eulerian import TemporalBandpass
+
+
+def _run(bandpass, video):
+    return np.stack([bandpass(frame).copy() for frame in video])
+
+
+def _video(dtype=np.float64, frames=90, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(frames)[:, None, None, None] / 30.0
+    video = 0.5 + 0.05 * np.sin(2 * np.pi * 1.3 * t) + 0.01 * rng.normal(size=(frames, 4, 5, 3))
+    return video.astype(dtype)
+
+
+@pytest.mark.parametrize('order', [1, 2])
+def test_butter_matches_sosfilt(order):
+    video = _video()
+    sos = signal.butter(order, [1.0, 1.8], btype='bandpass', fs=30.0, output='sos')
+    # Steady state on the first frame, as TemporalBandpass starts
+    zi = signal.sosfilt_zi(sos)[..., None, None, None] * video[0]
+    expected, _ = signal.sosfilt(sos, video, axis=0, zi=zi)
+
+    out = _run(TemporalBandpass(video.shape[1:], 1.0, 1.8, 30.0, 'butter', order, np.float64), video)
+
+    np.testing.assert_allclose(out, expected, atol=1e-12)
+
+
+def test_butter_float32_close_to_float64():
+    video = _video()
+    reference = _run(TemporalBandpass(video.shape[1:], 1.0, 1.8, 30.0, 'butter', dtype=np.float64), video)
+    out = _run(TemporalBandpass(video.shape[1:], 1.0, 1.8, 30.0, 'butter', dtype=np.float32),
+               video.astype(np.float32))
+
+    assert out.dtype == np.float32
+    np.testing.assert_allclose(out, reference, atol=1e-5)
+
+
+def test_difference_matches_lfilter():
+    video = _video()
+    expected = 0
+    for sign, cutoff in ((1, 1.8), (-1, 1.0)):
+        # y[n] = y[n-1] + r (x[n] - y[n-1]), starting at y[-1] = x[0]
+        rate = 1 - np.exp(-2 * np.pi * cutoff / 30.0)
+        lowpass, _ = signal.lfilter([rate], [1, rate - 1], video, axis=0, zi=(1 - rate) * video[:1])
+        expected = expected + sign * lowpass
+
+    out = _run(TemporalBandpass(video.shape[1:], 1.0, 1.8, 30.0, 'difference', dtype=np.float64), video)
+
+    np.testing.assert_allclose(out, expected, atol=1e-12)
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        TemporalBandpass((2, 2), 1.0, 1.8, 30.0, 'fft')
@@ -0,0 +1,53 @@
+"""
+FrameStore round trips against the NumPy arrays written into it.
+"""
+import numpy as np
+
+from frame_store import FrameStore
+
+
+def _frames(n, shape=(6, 8, 3), seed=0):
+    return np.random.default_rng(seed).integers(0, 256, size=(n,) + shape, dtype=np.uint8)
+
+
+def test_append_flush_and_reopen(tmp_path):
+    path = str(tmp_path / 'session.frames')
+    frames = _frames(5)
+    timestamps = np.arange(5) / 29.97
+
+    store = FrameStore.create(path, 8, frames.shape[1:], 29.97, roi=(np.int32(1), 2, 3, 4), subject='x')
+    for frame, timestamp in zip(frames, timestamps):
+        assert store.append(frame, timestamp)
+    store.close()
+
+    store = FrameStore.open(path)
+    assert len(store) == 5 and store.capacity == 8
+    assert store.fps == 29.97 and store.roi == (1, 2, 3, 4) and store.metadata['subject'] == 'x'
+    np.testing.assert_array_equal(store.frames, frames)
+    np.testing.assert_array_equal(store.timestamps, timestamps)
+
+
+def test_full_store_rejects_frames(tmp_path):
+    store = FrameStore.create(str(tmp_path / 'session.frames'), 2, (6, 8, 3), 30.0)
+    frames = _frames(3)
+
+    assert [store.append(frame) for frame in frames] == [True, True, False]
+    assert store.full and store.next_slot() is None
+    assert np.isnan(store.timestamps).all()
+
+
+def test_resized_keeps_frames_and_metadata(tmp_path):
+    frames = _frames(4)
+    store = FrameStore.create(str(tmp_path / 'a.frames'), 4, frames.shape[1:], 25.0, roi=(0, 0, 8, 6), note=1)
+    for i, frame in enumerate(frames):
+        np.copyto(store.next_slot(), frame)
+        store.commit(i / 25.0)
+
+    grown = store.resized(str(tmp_path / 'b.frames'), 8)
+    store.close(delete=True)
+    grown.append(frames[0], 4 / 25.0)
+
+    assert grown.capacity == 8 and len(grown) == 5
+    assert grown.fps == 25.0 and grown.roi == (0, 0, 8, 6) and grown.metadata['note'] == 1
+    np.testing.assert_array_equal(grown.frames[:4], frames)
+    np.testing.assert_allclose(grown.timestamps, np.arange(5) / 25.0)
@@ -0,0 +1,46 @@
+"""
+rolling_hrv against a per-window NumPy recomputation, and the beat/RR helpers.
+"""
+import numpy as np
+import pytest
+
+from hrv_analysis import analyze_hrv, compute_hrv_metrics, extract_rr_intervals, rolling_hrv
+
+
+def _beat_times(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.cumsum(rng.uniform(0.6, 1.1, n)) + 3.0
+
+
+def test_rolling_hrv_matches_per_window_numpy():
+    beat_times = _beat_times()
+    trend = rolling_hrv(beat_times, window_seconds=30.0, step_seconds=5.0)
+
+    rr_times = beat_times[1:]
+    rr = np.diff(beat_times) * 1000
+    assert trend['start'][0] == beat_times[0]
+    for i, (start, end) in enumerate(zip(trend['start'], trend['end'])):
+        window = rr[(rr_times >= start) & (rr_times < end)]
+        assert trend['count'][i] == len(window)
+        assert trend['mean_hr'][i] == pytest.approx(60000 / window.mean())
+        assert trend['sdnn'][i] == pytest.approx(np.std(window), abs=1e-6)
+        assert trend['rmssd'][i] == pytest.approx(np.sqrt(np.mean(np.diff(window) ** 2)))
+
+
+def test_rolling_hrv_too_few_beats():
+    trend = rolling_hrv([1.0])
+    assert len(trend['start']) == 0 and trend['valid'].dtype == bool
+
+
+def test_analyze_hrv_uses_detected_beats():
+    fps = 30.0
+    t = np.arange(0, 60, 1 / fps)
+    pulse = np.sin(2 * np.pi * 1.2 * t)
+
+    metrics = analyze_hrv(pulse, fps)
+    rr = extract_rr_intervals(pulse, fps)
+
+    assert metrics['valid']
+    np.testing.assert_allclose(metrics['rr_intervals'], np.round(rr, 2))
+    assert np.mean(rr) == pytest.approx(1000 / 1.2, rel=1e-3)
+    assert metrics['sdnn'] == compute_hrv_metrics(rr)['sdnn']
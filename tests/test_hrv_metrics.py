@@ -0,0 +1,65 @@
+"""
+batch_hrv_metrics against per-series NumPy and scipy.signal.lombscargle references.
+"""
+import numpy as np
+import pytest
+from scipy.signal import lombscargle
+
+from hrv_metrics import HF_BAND, LF_BAND, VLF_BAND, batch_hrv_metrics, hrv_metrics_rows, pack_rr_series
+
+
+# RR series of different lengths with a respiratory (HF) and a slower (LF) modulation
+def _rr_series(lengths, seed=0):
+    rng = np.random.default_rng(seed)
+    series = []
+    for n in lengths:
+        beats = np.arange(n)
+        rr = (800 + 40 * np.sin(2 * np.pi * 0.25 * beats * 0.8)
+              + 25 * np.sin(2 * np.pi * 0.1 * beats * 0.8) + rng.normal(0, 15, n))
+        series.append(rr)
+    return series
+
+
+def _band_power(rr, band, freq_step=1.0 / 512):
+    times = np.cumsum(rr) / 1000.0
+    frequencies = np.arange(VLF_BAND[0], HF_BAND[1] + freq_step, freq_step)
+    power = lombscargle(times, rr - rr.mean(), 2 * np.pi * frequencies)
+    psd = power * 2 * (times[-1] - times[0]) / len(rr)
+    mask = (frequencies >= band[0]) & (frequencies < band[1])
+    return psd[mask].sum() * freq_step
+
+
+def test_time_domain_matches_numpy():
+    series = _rr_series([5, 40, 2, 300])
+    metrics = batch_hrv_metrics(*pack_rr_series(series))
+
+    for i, rr in enumerate(series):
+        diffs = np.diff(rr)
+        assert metrics['count'][i] == len(rr)
+        assert metrics['mean_rr'][i] == pytest.approx(rr.mean())
+        assert metrics['mean_hr'][i] == pytest.approx(np.mean(60000 / rr))
+        assert metrics['sdnn'][i] == pytest.approx(np.std(rr))
+        assert metrics['rmssd'][i] == pytest.approx(np.sqrt(np.mean(diffs ** 2)))
+        assert metrics['sdsd'][i] == pytest.approx(np.std(diffs))
+        assert metrics['pnn50'][i] == pytest.approx(100 * np.mean(np.abs(diffs) > 50))
+
+
+def test_frequency_domain_matches_scipy_lombscargle():
+    series = _rr_series([300, 120], seed=1)
+    # A small block forces the periodogram to be split across series
+    metrics = batch_hrv_metrics(*pack_rr_series(series), max_block=4096)
+
+    for i, rr in enumerate(series):
+        assert metrics['vlf'][i] == pytest.approx(_band_power(rr, VLF_BAND), rel=1e-6)
+        assert metrics['lf'][i] == pytest.approx(_band_power(rr, LF_BAND), rel=1e-6)
+        assert metrics['hf'][i] == pytest.approx(_band_power(rr, HF_BAND), rel=1e-6)
+
+
+def test_short_and_empty_series():
+    metrics = batch_hrv_metrics(*pack_rr_series([[800.0], [], [800.0, 850.0]]))
+    rows = hrv_metrics_rows(metrics)
+
+    assert [row['valid'] for row in rows] == [False, False, True]
+    assert np.isnan(rows[0]['rmssd']) and np.isnan(rows[1]['mean_rr'])
+    assert np.isnan(rows[2]['hf'])
+    assert rows[2]['rmssd'] == pytest.approx(50.0)
@@ -0,0 +1,51 @@
+"""
+resample_trace / resample_uniform against np.interp.
+"""
+import numpy as np
+
+from resample import estimate_fps, resample_trace, resample_uniform
+
+
+def _jittered_times(n, fps, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.cumsum(rng.uniform(0.5, 1.5, n) / fps)
+
+
+def test_resample_trace_matches_np_interp():
+    timestamps = _jittered_times(200, 30.0)
+    trace = np.random.default_rng(1).normal(size=(200, 3)).astype(np.float32)
+
+    resampled, grid = resample_trace(trace, timestamps, 30.0)
+
+    assert resampled.dtype == np.float32
+    np.testing.assert_allclose(np.diff(grid), 1 / 30.0)
+    for channel in range(3):
+        expected = np.interp(grid, timestamps, trace[:, channel])
+        np.testing.assert_allclose(resampled[:, channel], expected, rtol=1e-5, atol=1e-6)
+
+
+def test_resample_trace_along_axis():
+    timestamps = _jittered_times(50, 25.0)
+    traces = np.random.default_rng(2).normal(size=(4, 50, 3))
+
+    resampled, grid = resample_trace(traces, timestamps, 25.0, axis=1)
+
+    for patch in range(4):
+        expected = np.interp(grid, timestamps, traces[patch, :, 0])
+        np.testing.assert_allclose(resampled[patch, :, 0], expected)
+
+
+def test_resample_uniform_leaves_uniform_traces_alone():
+    trace = np.arange(30.0)
+    out, fps = resample_uniform(trace, np.arange(30) / 29.97, 29.97)
+    assert out is trace and fps == 29.97
+
+
+def test_resample_uniform_drops_stalled_timestamps():
+    timestamps = np.array([0.0, 0.1, 0.1, np.nan, 0.2, 0.15, 0.3, 0.4])
+    trace = np.arange(len(timestamps), dtype=np.float64)
+
+    out, fps = resample_uniform(trace, timestamps)
+
+    assert fps == estimate_fps([0.0, 0.1, 0.2, 0.3, 0.4])
+    np.testing.assert_allclose(out, [0, 1, 4, 6, 7])
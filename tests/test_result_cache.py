@@ -0,0 +1,67 @@
+"""
+ResultCache round trips, keying and LRU eviction.
+"""
+import os
+
+import numpy as np
+
+from result_cache import ResultCache, file_digest
+
+
+def test_round_trip_arrays_and_json(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    trace = np.random.default_rng(0).normal(size=(50, 3)).astype(np.float32)
+
+    cache.put('trace', 'abc', {'trace': trace, 'fps': np.array(29.97)}, skin_mask=False)
+    cache.put('heart_rate', 'abc', {'heart_rate': np.float64(72.5), 'hrv_metrics': {'valid': True}},
+              freq_min=1.0)
+
+    artifact = cache.get('trace', 'abc', skin_mask=False)
+    np.testing.assert_array_equal(artifact['trace'], trace)
+    assert float(artifact['fps']) == 29.97
+    assert cache.get('heart_rate', 'abc', freq_min=1.0) == {'heart_rate': 72.5, 'hrv_metrics': {'valid': True}}
+
+
+def test_key_depends_on_kind_source_and_params(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put('spectrum', 'abc', {'spectrum': np.zeros(4)}, freq_min=1.0, freq_max=1.8)
+
+    assert cache.get('spectrum', 'abc', freq_max=1.8, freq_min=1.0) is not None
+    assert cache.get('spectrum', 'abc', freq_min=1.0, freq_max=2.0) is None
+    assert cache.get('spectrum', 'abd', freq_min=1.0, freq_max=1.8) is None
+    assert cache.get('trace', 'abc', freq_min=1.0, freq_max=1.8) is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    entry = {'data': np.zeros(1000)}
+    cache = ResultCache(str(tmp_path), max_bytes=10 ** 9)
+    for i, name in enumerate(['a', 'b', 'c']):
+        cache.put('trace', name, entry)
+        path = cache._path(cache.key('trace', name), '.npz')
+        os.utime(path, (i, i))
+    size = os.path.getsize(path)
+
+    # Reading 'a' makes 'b' the oldest entry
+    cache.get('trace', 'a')
+    cache.max_bytes = 2 * size
+    cache.evict()
+
+    assert cache.get('trace', 'b') is None
+    assert cache.get('trace', 'a') is not None and cache.get('trace', 'c') is not None
+
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put('trace', 'abc', {'trace': np.zeros(3)})
+    with open(cache._path(cache.key('trace', 'abc'), '.npz'), 'wb') as f:
+        f.write(b'not an npz')
+
+    assert cache.get('trace', 'abc') is None
+
+
+def test_file_digest_tracks_contents(tmp_path):
+    path = tmp_path / 'video.bin'
+    path.write_bytes(b'frames')
+    first = file_digest(str(path))
+    path.write_bytes(b'other frames')
+    assert file_digest(str(path)) != first